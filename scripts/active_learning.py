@@ -1,4 +1,9 @@
+import argparse
+import hashlib
 import logging 
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 from functools import partial
 
@@ -7,7 +12,9 @@ import numpy as np
 
 import pandas as pd
 
-from transformers import AutoTokenizer
+import torch
+
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
 from sklearn.metrics import f1_score, classification_report, precision_score
 from sklearn.model_selection import train_test_split
@@ -15,39 +22,71 @@ from sklearn.model_selection import train_test_split
 from small_text.active_learner import PoolBasedActiveLearner
 from small_text.initialization import random_initialization_balanced
 from small_text.integrations.transformers import TransformerModelArguments
-from small_text.integrations.transformers.classifiers.factories import TransformerBasedClassificationFactory
 from small_text.query_strategies import PoolExhaustedException, EmptyPoolException
 from small_text.query_strategies import RandomSampling, LeastConfidence, PredictionEntropy
 from small_text.integrations.transformers.datasets import TransformersDataset
 from small_text.base import LABEL_IGNORED, LABEL_UNLABELED
 
+from chunked_io import read_data
+from al_checkpoints import CHECKPOINT_DIR, Checkpointer, find_session, load_checkpoint, new_session
+from label_journal import JOURNAL_PATH, LabelJournal
+from embedding_index import EmbeddingIndex, IndexQueryStrategy, load_embeddings
+from incremental_training import DynamicPaddingClassificationFactory, configure_retraining
+
 #CONFIG
 TRANSFORMER_MODEL = TransformerModelArguments('roberta-base')
+# IndexedCoreset() and ClusterCoverage() of embedding_index.py select diverse batches from sentence embeddings
 QUERY_STRATEGY = PredictionEntropy()
 NUM_ITERATIONS = 10
 NUM_QUERY_SAMPLES = 20
 LABELS = ["future_statement", "none"]
 SAVE_SAMPLE = False 
 REPORT = True 
+# keep the checkpoint with the best test F1 score besides the latest one, see al_checkpoints.py
 SAVE_BEST = False 
+POOL_CACHE_DIR = '.cache/pool'
+# written by data_preprocessing.py --start_labeling, the shipped dataset is used if it doesn't exist
+UNLABELED_PATH = 'data/candidates_unlabeled.parquet'
+# compute the next query batch while the current one gets labeled
+PREFETCH_QUERIES = True
+# number of unlabeled samples scored per query, None scores the whole pool
+CANDIDATE_SUBSAMPLE = None
+# "random" or "clustered" (spread evenly over NUM_CLUSTERS clusters of the pool)
+SUBSAMPLE_STRATEGY = "random"
+NUM_CLUSTERS = 50
+SEED = 42
+# labeling and idle time of the annotator per round
+ROUND_STATS = "round_stats.txt"
+# continue training from the weights of the previous round for INCREMENTAL_EPOCHS epochs instead of from scratch
+INCREMENTAL_TRAINING = True
+INCREMENTAL_EPOCHS = 2
+# retrain from scratch every FULL_RETRAIN_EVERY rounds, None never
+FULL_RETRAIN_EVERY = 5
+# training time and test F1 per round
+TRAINING_STATS = "training_stats.txt"
 
 
-BEST_MODEL = None 
 f1_score_curve = []
+# label journal of SAVE_SAMPLE, opened with the first sample
+journal = None
 
-def main():
+def main(resume=None):
     """
     main function
+    :param resume: str
+        directory of the checkpoints of a session to resume or of all sessions to resume the latest one, None starts
+        a new session in CHECKPOINT_DIR
     """
     # Active learning parameters
-    clf_factory = TransformerBasedClassificationFactory(TRANSFORMER_MODEL,
+    clf_factory = DynamicPaddingClassificationFactory(TRANSFORMER_MODEL,
                                                         len(LABELS),
                                                         kwargs=dict({'device': 'cuda'}))
 
 
     # Prepare some data
     train_labeled, train, test = load_dataset("data/candidates_labeled.pkl",
-                                              "data/candidates_unlabeled.pkl")
+                                              UNLABELED_PATH if os.path.isdir(UNLABELED_PATH)
+                                              else "data/candidates_unlabeled.pkl")
     
     tokenizer = AutoTokenizer.from_pretrained(TRANSFORMER_MODEL.model, cache_dir='.cache/')
     x_train = preprocess_data(tokenizer, train["candidate"].values, train["label"].values)
@@ -55,19 +94,34 @@ def main():
     x_test = preprocess_data(tokenizer, test["candidate"].values, test["label"].values)
 
 
+    if isinstance(QUERY_STRATEGY, IndexQueryStrategy):
+        QUERY_STRATEGY.index = EmbeddingIndex(load_embeddings(train["candidate"].values))
+
     #Active learner
     active_learner = PoolBasedActiveLearner(clf_factory, QUERY_STRATEGY, x_train)
-    print(y_train)
-    labeled_indices = initialize_active_learner(active_learner, y_train)
+    # the checkpoints store positions in the pool, they are only valid for the same pool
+    pool = pool_key(tokenizer, train["candidate"].values)
+    session = find_session(resume) if resume else new_session()
+    checkpointer = Checkpointer(session, resume is not None, SAVE_BEST, {"pool": pool})
+    if resume:
+        labeled_indices, first_round = resume_active_learner(active_learner, session, pool)
+    else:
+        print(y_train)
+        labeled_indices = initialize_active_learner(active_learner, y_train)
+        checkpointer.save(active_learner, 0)
+        first_round = 1
     print(classification_report(x_test.y, active_learner.classifier.predict(x_test), target_names=LABELS))
-    save_model(active_learner)
 
     try:
-        perform_active_learning(active_learner, x_train, labeled_indices, x_test, train.values)
+        perform_active_learning(active_learner, x_train, labeled_indices, x_test, train.values, checkpointer,
+                                first_round)
     except PoolExhaustedException:
         print('Error! Not enough samples left to handle the query.')
     except EmptyPoolException:
         print('Error! No more samples left. (Unlabeled pool is empty)')
+    checkpointer.close()
+    if journal is not None:
+        journal.close()
     
     print(classification_report(x_test.y, active_learner.classifier.predict(x_test), target_names=LABELS))
 
@@ -94,7 +148,7 @@ def load_dataset(labeled_ds_path, unlabeled_ds_path):
     train_labeled, test_labeled = train_test_split(df_labeled, test_size=0.4, stratify=df_labeled["label"], random_state=42)
 
     # load unlabeled
-    train_unlabeled = pd.read_pickle(unlabeled_ds_path)
+    train_unlabeled = read_data(unlabeled_ds_path)
     train_unlabeled["label"] = LABEL_UNLABELED
     train_unlabeled["label"] = train_unlabeled["label"].astype("int64")
 
@@ -102,15 +156,82 @@ def load_dataset(labeled_ds_path, unlabeled_ds_path):
 
     return train_labeled, pd.concat([train_labeled, train_unlabeled], axis=0, ignore_index=True), test_labeled 
 
-def save_sample(oracle, sentence):
-    files = {"fs":"future_statements.txt", "n":"nones.txt"}
-    with open(files[oracle], mode="a") as f:
-        f.write(sentence + "\n")
+def save_sample(label, sentence):
+    """
+    Appends an annotation to the label journal shared with data_preprocessing.py
+    :param label: int
+        the label of the sentence
+    :param sentence: str
+        the annotated sentence
+    """
+    global journal
+    if journal is None:
+        journal = LabelJournal(JOURNAL_PATH)
+    journal.append(sentence, label, "active_learning")
+
+
+def pool_key(tokenizer, data, max_length=500):
+    """
+    :param tokenizer: AutoTokenizer
+        containing the tokenizer of the model
+    :param data: List[str]
+        the text data
+    :param max_length: int
+        Maximum sequence length to encode
+    :return str
+        name of the encoded pool, derived from the tokenizer name, max_length and the sentences
+    """
+    digest = hashlib.blake2b(f"{tokenizer.name_or_path}\0{max_length}".encode("utf-8"), digest_size=16)
+    for sentence in data:
+        digest.update(sentence.encode("utf-8") + b"\0")
+    name = os.path.basename(os.path.normpath(tokenizer.name_or_path))
+    return f"{name}-{max_length}-{digest.hexdigest()}"
+
+
+def encode_pool(tokenizer, data, max_length=500, cache_dir=POOL_CACHE_DIR):
+    """
+    Tokenizes a list of string sentences and caches the result as .npy files: the input ids of all sentences padded to
+    the longest one (int32) and their true lengths (int16). The cache is keyed by the tokenizer name, max_length and
+    the sentences (see pool_key()), so that later sessions with the same pool only have to memory-map the files.
+    :param tokenizer: AutoTokenizer
+        containing the tokenizer of the model
+    :param data: List[str]
+        the text data
+    :param max_length: int
+        Maximum sequence length to encode
+    :param cache_dir: str
+        directory of the cached pools
+    :return np.ndarray
+        memory-mapped input ids of shape (number of sentences, length of the longest sentence)
+    :return np.ndarray
+        memory-mapped number of tokens of every sentence
+    """
+    path = os.path.join(cache_dir, pool_key(tokenizer, data, max_length))
+
+    if not os.path.isdir(path):
+        print('encoding pool of {} sentences...'.format(len(data)))
+        input_ids = tokenizer(list(data), add_special_tokens=True, truncation='longest_first',
+                              max_length=max_length)['input_ids']
+        lengths = np.array([len(ids) for ids in input_ids], dtype=np.int16)
+        padded = np.full((len(input_ids), lengths.max(initial=1)), tokenizer.pad_token_id, dtype=np.int32)
+        for i, ids in enumerate(input_ids):
+            padded[i, :len(ids)] = ids
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, "input_ids.npy"), padded)
+        np.save(os.path.join(tmp_path, "lengths.npy"), lengths)
+        os.replace(tmp_path, path)
+
+    # copy-on-write mappings can be wrapped by torch tensors without copying them
+    return np.load(os.path.join(path, "input_ids.npy"), mmap_mode='c'), \
+        np.load(os.path.join(path, "lengths.npy"), mmap_mode='c')
 
 
 def preprocess_data(tokenizer, data, labels, max_length=500):
     """
-    Converts a list of string sentence into an TransformersDataset as model input
+    Converts a list of string sentence into an TransformersDataset as model input.
+    The encoded pool is cached (see encode_pool()) and every row of the dataset is a view into the memory-mapped cache.
+    All sentences are padded to the longest sentence of the pool instead of max_length.
     :param tokenizer: AutoTokenizer
         containing the tokenizer of the model
     :param data: List[str]
@@ -120,25 +241,22 @@ def preprocess_data(tokenizer, data, labels, max_length=500):
     :return TransformerDataset
         the dataset to input into the model
     """
-    data_out = []
-
-    for i, doc in enumerate(data):
-        encoded_dict = tokenizer.encode_plus(
-            doc,
-            add_special_tokens=True,
-            padding='max_length',
-            max_length=max_length,
-            return_attention_mask=True,
-            return_tensors='pt',
-            truncation='longest_first'
-        )
-        data_out.append((encoded_dict['input_ids'], encoded_dict['attention_mask'], labels[i]))
-    
+    input_ids, lengths = encode_pool(tokenizer, data, max_length)
+    input_ids = torch.from_numpy(input_ids)
+    attention_mask = torch.from_numpy(np.arange(input_ids.shape[1]) < lengths[:, None]).int()
+    data_out = [(input_ids[i:i + 1], attention_mask[i:i + 1], labels[i]) for i in range(len(data))]
+
     return TransformersDataset(data_out)
 
-def perform_active_learning(active_learner, train, labeled_indices, test, text):
+def perform_active_learning(active_learner, train, labeled_indices, test, text, checkpointer=None, first_round=1):
     """
-    Central function that performs the active learning iterations
+    Central function that performs the active learning iterations.
+    With PREFETCH_QUERIES the next query batch is computed in a background thread while the current batch gets
+    labeled: the thread first retrains the model with the labels of the previous batch and then queries the next batch
+    from the pool without the batch that is being labeled, so the annotator only waits if labeling is faster than
+    retraining and querying. The output of the background thread is printed after the labeling of the batch, so that it
+    doesn't interleave with the prompts of the annotator. The time spent labeling and waiting is recorded per round in
+    ROUND_STATS.
     :param active_learner: PoolBasedActiveLearner
         small-text's main active learning object
     :param train: TransformerDataset
@@ -149,43 +267,220 @@ def perform_active_learning(active_learner, train, labeled_indices, test, text):
         test (evaluation) set used to assess performance
     :return text: List[str]
         List of not encoded samples to keep samples human readable
+    :param checkpointer: Checkpointer
+        writes a checkpoint after every round, None disables checkpoints
+    :param first_round: int
+        number of the first round, larger than 1 for resumed sessions
     """
-
+    rng = np.random.default_rng(SEED)
+    clusters = cluster_pool(text) if CANDIDATE_SUBSAMPLE and SUBSAMPLE_STRATEGY == "clustered" else None
+
+    rounds = first_round - 1
+
+    def retrain(q_indices, y, log=print):
+        nonlocal labeled_indices, rounds
+        rounds += 1
+        full_retrain = configure_retraining(active_learner, rounds, INCREMENTAL_TRAINING, INCREMENTAL_EPOCHS,
+                                            FULL_RETRAIN_EVERY)
+        # Return the labels for the query to the active learner.
+        active_learner.indices_queried = q_indices
+        training_start = time.perf_counter()
+        active_learner.update(y)
+        training = time.perf_counter() - training_start
+        labeled_indices = np.concatenate([q_indices, labeled_indices])
+        log('Retrained with {} samples'.format(len(labeled_indices)))
+        f1_score_test = evaluate(active_learner, train[labeled_indices], test, log)
+        record_training(rounds, full_retrain, training, f1_score_test, log)
+        if checkpointer is not None:
+            checkpointer.save(active_learner, rounds, f1_score_test)
+
+    def prefetch(previous, q_indices, query_next):
+        output = []
+        if previous is not None:
+            retrain(*previous, log=output.append)
+        return query_candidates(active_learner, q_indices, rng, clusters) if query_next else None, output
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    idle_start = time.perf_counter()
+    q_indices = query_candidates(active_learner, np.array([], dtype=int), rng, clusters)
+    idle = time.perf_counter() - idle_start
+    previous = None
     # Perform [NUM_ITERATIONS] iterations of active learning...
     for i in range(NUM_ITERATIONS):
+        last_round = i == NUM_ITERATIONS - 1
+        if PREFETCH_QUERIES:
+            next_query = executor.submit(prefetch, previous, q_indices, not last_round)
+
         # ...where each iteration consists of labelling [QUERY_SAMPLES] samples
-        q_indices = active_learner.query(num_samples=NUM_QUERY_SAMPLES)
-        
-        y = []
-        annotations = {"fs":0, "n":1}
-        for i, q_index in enumerate(q_indices):
-            print(i, text[q_index][0])
-            while True:
-                oracle = input("[f]uture statement, [n]one, [i]gnore ")
-                if oracle in list(annotations.keys()):
-                    print("Label als", annotations[oracle])
-                    if SAVE_SAMPLE:
-                        save_sample(oracle, text[q_index][0])
-
-                    y.append(annotations[oracle])
-                    break 
-                if oracle == "i":
-                    y.append(LABEL_IGNORED)
-                    print("ignored")
-                    break
-                else:
-                    print("improper input. Try again!")
-                
-        y = np.asarray(y).astype("int16")
-        # Return the labels for the current query to the active learner.
+        labeling_start = time.perf_counter()
+        y = annotate(q_indices, text)
+        labeling = time.perf_counter() - labeling_start
+
+        idle_start = time.perf_counter()
+        if PREFETCH_QUERIES:
+            next_q_indices, output = next_query.result()
+            if output:
+                print("\n".join(output))
+            previous = (q_indices, y)
+        else:
+            retrain(q_indices, y)
+            next_q_indices = None if last_round else query_candidates(active_learner, np.array([], dtype=int), rng,
+                                                                      clusters)
+        record_round(i, labeling, idle)
+        idle = time.perf_counter() - idle_start
+        q_indices = next_q_indices
+
+    executor.shutdown()
+    if previous is not None:
+        retrain(*previous)
+    save_model(active_learner)
 
-        active_learner.update(y)
 
-        labeled_indices = np.concatenate([q_indices, labeled_indices])
+def annotate(q_indices, text):
+    """
+    Prints the queried samples and asks the annotator for their labels.
+    :param q_indices: numpy.ndarray[int]
+        indices of the queried samples
+    :param text: List[str]
+        List of not encoded samples to keep samples human readable
+    :return numpy.ndarray[int]
+        labels of the queried samples
+    """
+    y = []
+    annotations = {"fs":0, "n":1}
+    for i, q_index in enumerate(q_indices):
+        print(i, text[q_index][0])
+        while True:
+            oracle = input("[f]uture statement, [n]one, [i]gnore ")
+            if oracle in list(annotations.keys()):
+                print("Label als", annotations[oracle])
+                if SAVE_SAMPLE:
+                    save_sample(annotations[oracle], text[q_index][0])
+
+                y.append(annotations[oracle])
+                break 
+            if oracle == "i":
+                y.append(LABEL_IGNORED)
+                print("ignored")
+                break
+            else:
+                print("improper input. Try again!")
+
+    return np.asarray(y).astype("int16")
+
+
+def query_candidates(active_learner, excluded, rng, clusters=None):
+    """
+    Queries the next batch from the unlabeled pool without the given samples. With CANDIDATE_SUBSAMPLE only a subset
+    of the pool gets scored.
+    :param active_learner: PoolBasedActiveLearner
+        small-text's main active learning object
+    :param excluded: numpy.ndarray[int]
+        indices of samples that must not be queried, e.g. the batch that is being labeled
+    :param rng: numpy.random.Generator
+        random generator of the subsampling
+    :param clusters: numpy.ndarray[int]
+        cluster of every sample for the clustered subsampling, see cluster_pool()
+    :return numpy.ndarray[int]
+        indices of the queried samples
+    """
+    size = len(active_learner.dataset)
+    indices_labeled = active_learner.indices_labeled
+    indices_unlabeled = np.setdiff1d(np.arange(size),
+                                     np.concatenate([indices_labeled, active_learner.indices_ignored, excluded]))
+    # strategies on the embedding index don't score the dataset, the candidates can be passed as they are
+    if isinstance(active_learner.query_strategy, IndexQueryStrategy) and CANDIDATE_SUBSAMPLE \
+            and len(indices_unlabeled) > CANDIDATE_SUBSAMPLE:
+        indices_unlabeled = subsample_candidates(indices_unlabeled, CANDIDATE_SUBSAMPLE, rng, clusters)
+    if not CANDIDATE_SUBSAMPLE or len(indices_unlabeled) <= CANDIDATE_SUBSAMPLE:
+        return active_learner.query_strategy.query(active_learner.classifier, active_learner.dataset,
+                                                   indices_unlabeled, indices_labeled, active_learner.y,
+                                                   n=NUM_QUERY_SAMPLES)
+
+    candidates = subsample_candidates(indices_unlabeled, CANDIDATE_SUBSAMPLE, rng, clusters)
+    # the query strategy only sees the candidates and the labeled samples
+    subset = np.concatenate([candidates, indices_labeled])
+    positions = active_learner.query_strategy.query(active_learner.classifier, active_learner.dataset[subset],
+                                                    np.arange(len(candidates)),
+                                                    np.arange(len(candidates), len(subset)), active_learner.y,
+                                                    n=NUM_QUERY_SAMPLES)
+    return candidates[positions]
+
+
+def subsample_candidates(indices_unlabeled, size, rng, clusters=None):
+    """
+    Draws a random subset of the unlabeled pool. If clusters are given, the subset is spread evenly over the clusters
+    and filled up with random samples.
+    :param indices_unlabeled: numpy.ndarray[int]
+        indices of the unlabeled samples
+    :param size: int
+        size of the subset
+    :param rng: numpy.random.Generator
+        random generator
+    :param clusters: numpy.ndarray[int]
+        cluster of every sample of the pool
+    :return numpy.ndarray[int]
+        sorted indices of the subset
+    """
+    if clusters is None:
+        return np.sort(rng.choice(indices_unlabeled, size, replace=False))
+    unlabeled_clusters = clusters[indices_unlabeled]
+    groups = [indices_unlabeled[unlabeled_clusters == cluster] for cluster in np.unique(unlabeled_clusters)]
+    per_cluster = size // len(groups)
+    chosen = np.concatenate([rng.choice(group, min(per_cluster, len(group)), replace=False) for group in groups])
+    rest = np.setdiff1d(indices_unlabeled, chosen)
+    return np.sort(np.concatenate([chosen, rng.choice(rest, size - len(chosen), replace=False)]))
+
+
+def cluster_pool(text):
+    """
+    Clusters the samples of the pool by their TF-IDF weighted word and bigram features.
+    :param text: List[str]
+        List of not encoded samples
+    :return numpy.ndarray[int]
+        cluster of every sample
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
 
-        print('Iteration #{:d} ({} samples)'.format(i, len(labeled_indices)))
-        evaluate(active_learner, train[labeled_indices], test)
-        save_model(active_learner)
+    features = HashingVectorizer(ngram_range=(1, 2), alternate_sign=False).transform([row[0] for row in text])
+    features = TfidfTransformer().fit_transform(features)
+    return MiniBatchKMeans(n_clusters=NUM_CLUSTERS, random_state=SEED, n_init=3).fit_predict(features)
+
+
+def record_round(iteration, labeling, idle):
+    """
+    Prints and appends the time the annotator spent labeling and waiting in a round to ROUND_STATS.
+    :param iteration: int
+        number of the round
+    :param labeling: float
+        seconds spent labeling
+    :param idle: float
+        seconds spent waiting for the queried batch
+    """
+    print('Iteration #{:d}: labeling {:.1f}s, annotator idle {:.1f}s'.format(iteration, labeling, idle))
+    with open(ROUND_STATS, "a+") as f:
+        f.write(f"{dt.today().isoformat()},{iteration},{labeling:.2f},{idle:.2f}\n")
+
+
+def record_training(iteration, full_retrain, training, f1_score_test, log=print):
+    """
+    Prints and appends the training time and the test F1 score of a round to TRAINING_STATS.
+    :param iteration: int
+        number of the round
+    :param full_retrain: Boolean
+        True if the model was retrained from scratch
+    :param training: float
+        seconds spent training
+    :param f1_score_test: float
+        macro F1 score on the test set
+    :param log: Callable
+        prints the output
+    """
+    mode = "full" if full_retrain else "incremental"
+    log('Round #{:d}: {} training {:.1f}s, test F1 {:.3f}'.format(iteration, mode, training, f1_score_test))
+    with open(TRAINING_STATS, "a+") as f:
+        f.write(f"{dt.today().isoformat()},{iteration},{mode},{training:.2f},{f1_score_test:.4f}\n")
 
 
 def initialize_active_learner(active_learner, y_train):
@@ -207,7 +502,35 @@ def initialize_active_learner(active_learner, y_train):
 
     return x_indices_initial
 
-def evaluate(active_learner, train, test):
+def resume_active_learner(active_learner, checkpoint_dir, pool=None):
+    """
+    Restores the classifier and the labeled pool of the active learner from the latest checkpoint without retraining
+    :param active_learner: PoolBasedActiveLearner
+        small-text's main active learning object, created with the same pool as the resumed session
+    :param checkpoint_dir: str
+        directory of the checkpoints
+    :param pool: str
+        key of the current pool (see pool_key()), a checkpoint of another pool is refused
+    :return np.ndarray
+        indices of labeled and ignored samples
+    :return int
+        number of the next round
+    """
+    path, state, meta = load_checkpoint(checkpoint_dir)
+    if pool is not None and meta.get("pool") != pool:
+        raise ValueError(f"{path} was written for the pool {meta.get('pool')}, not for the current pool {pool}")
+    print('resuming round {} from {}'.format(meta["iteration"], path))
+    active_learner.initialize_data(state["indices_labeled"], state["y"], state["indices_ignored"], retrain=False)
+    clf = active_learner._clf_factory.new()
+    clf.tokenizer = AutoTokenizer.from_pretrained(path)
+    clf.model = AutoModelForSequenceClassification.from_pretrained(path).to(clf.device)
+    clf.config = clf.model.config
+    # small-text has no public way to set the classifier of an active learner without training it
+    active_learner._clf = clf
+    return np.concatenate([state["indices_labeled"], state["indices_ignored"]]), meta["iteration"] + 1
+
+
+def evaluate(active_learner, train, test, log=print):
     """
     Evaluates the performance of the active_learner against the train and test (evualation) set
     Prints classification_report against evluation set 
@@ -217,8 +540,10 @@ def evaluate(active_learner, train, test):
         the train data 
     :return test: TransformerDataset
         test (evaluation) set used to assess performance
-    :return np.ndarray
-        indices of samples in the initially labeled train set
+    :param log: Callable
+        prints the output, e.g. list.append to print it later
+    :return float
+        macro F1 score on the test set
     """
 
     y_pred = active_learner.classifier.predict(train)
@@ -227,31 +552,22 @@ def evaluate(active_learner, train, test):
     precission_score_test = precision_score(test.y, y_pred_test, average="macro")
     with open("scores.txt", "a+") as f:
         f.write(f"{precission_score_test}\n")
-    print('Train accuracy: {:.2f}'.format(
+    log('Train accuracy: {:.2f}'.format(
         f1_score(train.y, y_pred, average='macro')))
-    print('Test accuracy: {:.2f}'.format(f1_score_test))
+    log('Test accuracy: {:.2f}'.format(f1_score_test))
     
     if REPORT:
-        print(classification_report(test.y, y_pred_test, target_names=LABELS))
+        log(classification_report(test.y, y_pred_test, target_names=LABELS))
 
-    print('---')
+    log('---')
 
-    # preserve only best
-    if SAVE_BEST:
-      global BEST_MODEL 
-      if BEST_MODEL is not None:
-        best_y_pred_test = BEST_MODEL.classifier.predict(test) 
-        if f1_score_test > f1_score(test.y, best_y_pred_test, average='macro'): 
-          print("save new best model")
-          BEST_MODEL = active_learner 
-      else: 
-        BEST_MODEL = active_learner 
+    return f1_score_test
 
 
 
 def save_model(model):
     """
-    save the model
+    save the model with the complete pool, the latest and the best round are also kept as checkpoints
     :param model: PoolBasedActiveLearner
         the active learner object to be serialized 
     """
@@ -259,13 +575,14 @@ def save_model(model):
     name = input("Name of to be saved model[Enter to skip, no save]: ")
     if name != "":
         model.save(F"./models/{date}_{name}.pkl")
-    
-    #always save best model
-    if BEST_MODEL is not None:
-      BEST_MODEL.save(f"./models/{date}_best.pkl")
 
 
 if __name__ == '__main__':
     logging.getLogger('small_text').setLevel(logging.INFO)
     logging.getLogger('transformers.modeling_utils').setLevel(logging.ERROR)
-    main()
+    parser = argparse.ArgumentParser(description="Label candidates with active learning.")
+    parser.add_argument('--resume', nargs="?", const=CHECKPOINT_DIR, action='store',
+                        help='Continue the session of the latest checkpoint in a given session directory or the '
+                             f'latest session in a given directory (default: {CHECKPOINT_DIR}).')
+    args = parser.parse_args()
+    main(args.resume)
@@ -0,0 +1,178 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt
+
+import numpy as np
+
+# every session writes its checkpoints to its own subdirectory, see new_session()
+CHECKPOINT_DIR = "models/checkpoints"
+# points to the latest and the best checkpoint of a directory
+INDEX_NAME = "checkpoints.json"
+
+
+class Checkpointer:
+    """
+    Writes lightweight checkpoints of an active learning session: the classifier in the HuggingFace format and the
+    labeled indices with their labels, but not the encoded pool. The weights are copied on the calling thread and
+    written by a background thread, so that the session only waits for the copy. Only the latest and the best
+    checkpoint are kept, the best one is chosen by the score passed to save().
+    """
+
+    def __init__(self, directory, resume=False, keep_best=True, meta=None):
+        """
+        :param directory: str
+            directory of the checkpoints of the session, see new_session() and find_session()
+        :param resume: Boolean
+            continue the index of an earlier session, a directory that already contains checkpoints is refused
+            otherwise
+        :param keep_best: Boolean
+            keep the checkpoint with the best score besides the latest one
+        :param meta: dict
+            additional fields of the meta.json of every checkpoint, e.g. the key of the pool the indices refer to
+        """
+        index = read_index(directory)
+        if index is not None and not resume:
+            raise FileExistsError(f"{directory} already contains checkpoints, resume the session or start a new one")
+        self.directory = directory
+        self.keep_best = keep_best
+        self.meta = meta or {}
+        os.makedirs(directory, exist_ok=True)
+        self.index = index or {"latest": None, "best": None, "best_score": None}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def save(self, active_learner, iteration, score=None):
+        """
+        Starts writing a checkpoint in the background, a checkpoint that is still being written is finished first.
+        :param active_learner: PoolBasedActiveLearner
+            small-text's main active learning object
+        :param iteration: int
+            number of the round
+        :param score: float
+            score of the classifier (e.g. test F1), higher is better, None never becomes the best checkpoint
+        :return: Future
+            finishes when the checkpoint is written
+        """
+        clf = active_learner.classifier
+        # copied now, the classifier keeps training while the checkpoint is written
+        state_dict = {key: value.detach().to("cpu", copy=True) for key, value in clf.model.state_dict().items()}
+        state = {"indices_labeled": np.array(active_learner.indices_labeled),
+                 "y": np.array(active_learner.y),
+                 "indices_ignored": np.array(active_learner.indices_ignored)}
+        # the index is only changed by the background thread while a checkpoint is pending
+        self.wait()
+        best_score = self.index["best_score"]
+        is_best = score is not None and (best_score is None or score > best_score)
+        if is_best:
+            self.index["best_score"] = score
+            if self.keep_best:
+                print("save new best model")
+        self.pending = self.executor.submit(self._write, clf.model, clf.tokenizer, state_dict, state,
+                                            {**self.meta, "iteration": iteration, "score": score,
+                                             "date": dt.today().isoformat()}, is_best)
+        return self.pending
+
+    def _write(self, model, tokenizer, state_dict, state, meta, is_best):
+        name = f"round-{meta['iteration']:04d}"
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        model.save_pretrained(tmp_path, state_dict=state_dict)
+        tokenizer.save_pretrained(tmp_path)
+        np.savez(os.path.join(tmp_path, "state.npz"), **state)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf8") as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+        self.index["latest"] = name
+        if is_best:
+            self.index["best"] = name
+        index_path = os.path.join(self.directory, INDEX_NAME)
+        with open(index_path + ".tmp", "w", encoding="utf8") as f:
+            json.dump(self.index, f)
+        os.replace(index_path + ".tmp", index_path)
+
+        kept = {self.index["latest"], self.index["best"] if self.keep_best else None}
+        for entry in os.listdir(self.directory):
+            if entry.startswith("round-") and entry not in kept:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+    def wait(self):
+        """
+        Waits until the pending checkpoint is written, errors of the background thread are raised here.
+        """
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+
+def new_session(root=CHECKPOINT_DIR):
+    """
+    :param root: str
+        directory of all sessions
+    :return: str
+        new directory for the checkpoints of a session, named by its start time
+    """
+    return os.path.join(root, dt.today().strftime("%Y%m%d-%H%M%S"))
+
+
+def find_session(directory=CHECKPOINT_DIR):
+    """
+    :param directory: str
+        directory of the checkpoints of a session or directory of all sessions
+    :return: str
+        the given directory if it contains checkpoints, otherwise its latest session
+    """
+    if read_index(directory) is not None:
+        return directory
+    sessions = sorted(entry for entry in os.listdir(directory) if read_index(os.path.join(directory, entry)))
+    if not sessions:
+        raise FileNotFoundError(f"no checkpoint in {directory}")
+    return os.path.join(directory, sessions[-1])
+
+
+def read_index(directory=CHECKPOINT_DIR):
+    """
+    :param directory: str
+        directory of the checkpoints
+    :return: dict
+        names of the latest and the best checkpoint and the best score, None if there is no checkpoint
+    """
+    index_path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def load_checkpoint(directory=CHECKPOINT_DIR, name=None):
+    """
+    Loads a checkpoint written by Checkpointer.
+    :param directory: str
+        directory of the checkpoints of a session or directory of all sessions, see find_session()
+    :param name: str
+        name of the checkpoint, None loads the latest one
+    :return: str
+        path of the checkpoint, it can also be loaded like a classifier-only export by future_inference.py
+    :return: dict
+        labeled indices, their labels and the ignored indices of the session
+    :return: dict
+        number of the round, score and date of the checkpoint
+    """
+    directory = find_session(directory)
+    index = read_index(directory)
+    if name is None and index["latest"] is None:
+        raise FileNotFoundError(f"no checkpoint in {directory}")
+    path = os.path.join(directory, name or index["latest"])
+    with np.load(os.path.join(path, "state.npz")) as state:
+        state = dict(state)
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf8") as f:
+        meta = json.load(f)
+    return path, state, meta
@@ -0,0 +1,131 @@
+import json
+import os
+import socket
+import threading
+import time
+
+
+class ShardWriter:
+    """
+    Buffers matched sentences together with their url and score and appends them as JSON lines to a small number of
+    rotating shard files, instead of writing one file per website.
+    Every writer uses its own shard names (host and process id), so several workers can write into the same directory.
+    The buffer is flushed when it exceeds a given size or when it is older than a given interval.
+    """
+
+    def __init__(self, out_dir, prefix=None, max_shard_bytes=256 * 2 ** 20, flush_bytes=4 * 2 ** 20,
+                 flush_interval=30):
+        """
+        :param out_dir: str
+            directory the shard files are written to
+        :param prefix: str
+            file name prefix of the shards, defaults to hostname and process id
+        :param max_shard_bytes: int
+            size after which a new shard file is started
+        :param flush_bytes: int
+            buffer size after which the buffer is written to the current shard
+        :param flush_interval: float
+            seconds after which a non-empty buffer is written to the current shard
+        """
+        self.out_dir = out_dir
+        self.prefix = prefix or f"{socket.gethostname()}_{os.getpid()}"
+        self.max_shard_bytes = max_shard_bytes
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.last_flush = time.monotonic()
+        self.shard_index = 0
+        self.shard = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    def write(self, url, prediction, sentences):
+        """
+        Adds the matched sentences of one website to the buffer.
+        :param url: str
+            url of the website
+        :param prediction: float
+            score of the website
+        :param sentences: List[str]
+            matched sentences of the website
+        """
+        line = json.dumps({"url": url, "prediction": prediction, "sentences": sentences}, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.buffer.append(line)
+            self.buffer_bytes += len(line)
+            if self.buffer_bytes >= self.flush_bytes:
+                self._flush()
+
+    def flush_if_due(self):
+        """
+        Writes the buffer to the current shard if it is older than the flush interval.
+        """
+        with self.lock:
+            if self.buffer and time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def close(self):
+        """
+        Writes the remaining buffer and closes the current shard.
+        """
+        with self.lock:
+            self._flush()
+            if self.shard is not None:
+                self.shard.close()
+                self.shard = None
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        if self.shard is None:
+            self._open_next_shard()
+        self.shard.write("".join(self.buffer))
+        self.shard.flush()
+        self.buffer = []
+        self.buffer_bytes = 0
+        if self.shard.tell() >= self.max_shard_bytes:
+            self.shard.close()
+            self.shard = None
+
+    def _open_next_shard(self):
+        # never append to shards of an earlier run with the same prefix
+        while True:
+            path = os.path.join(self.out_dir, f"{self.prefix}_{self.shard_index:05d}.jsonl")
+            self.shard_index += 1
+            if not os.path.exists(path):
+                break
+        self.shard = open(path, "a", encoding="utf-8")
+
+
+def read_shard(path):
+    """
+    Reads a shard file written by a ShardWriter line by line.
+    :param path: str
+        path to shard file
+    :return: Iterator[dict]
+        records with keys "url", "prediction" and "sentences"
+    """
+    with open(path, "r", encoding="utf-8") as shard:
+        yield from parse_shard_lines(shard, path)
+
+
+def parse_shard_lines(lines, path):
+    """
+    Parses lines of a shard file written by a ShardWriter.
+    :param lines: Iterable[str]
+        lines of the shard file
+    :param path: str
+        path to shard file, only used for error messages
+    :return: Iterator[dict]
+        records with keys "url", "prediction" and "sentences"
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            # only the last line of a shard can be incomplete, if its writer got killed during a flush
+            print(f"Skipping incomplete record in {path}")
@@ -0,0 +1,200 @@
+import argparse
+import functools
+import pickle
+
+import numpy as np
+
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+
+CASCADE_PATH = "models/future_cascade.pkl"
+# candidate thresholds on the maximum probability of the first stage
+THRESHOLDS = np.round(np.arange(0.5, 1.0, 0.01), 2)
+
+
+class Cascade:
+    """
+    Cheap first stage of the future statement classification: a linear model on hashed word n-grams, distilled from
+    the predictions of the transformer. Sentences whose maximum first-stage probability is below the threshold are
+    escalated to the transformer, all others keep the first-stage decision.
+    """
+
+    def __init__(self, pipeline, threshold, curve=None):
+        """
+        :param pipeline: Pipeline
+            the fitted first-stage model
+        :param threshold: float
+            minimum probability of a first-stage decision that is accepted
+        :param curve: List[Tuple[float, float, float]]
+            threshold, escalation rate and agreement with the transformer measured on held out sentences
+        """
+        self.pipeline = pipeline
+        self.threshold = threshold
+        self.curve = curve or []
+
+    def predict_proba(self, sentences):
+        """
+        :param sentences: List[str]
+            sentences to predict
+        :return: np.ndarray
+            first-stage probabilities of shape (number of sentences, number of classes)
+        """
+        return self.pipeline.predict_proba(sentences).astype(np.float32)
+
+    def split(self, sentences):
+        """
+        :param sentences: List[str]
+            sentences to predict
+        :return: np.ndarray
+            first-stage probabilities of shape (number of sentences, number of classes)
+        :return: np.ndarray[bool]
+            True for every sentence that has to be escalated to the transformer
+        """
+        probabilities = self.predict_proba(sentences)
+        return probabilities, probabilities.max(axis=1) < self.threshold
+
+    def save(self, path=CASCADE_PATH):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path=CASCADE_PATH):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def first_stage(n_features=2 ** 20):
+    """
+    :param n_features: int
+        number of hashed features
+    :return: Pipeline
+        unfitted TF-IDF weighted word uni- and bigram model with a logistic regression
+    """
+    return make_pipeline(HashingVectorizer(ngram_range=(1, 2), alternate_sign=False, n_features=n_features),
+                         TfidfTransformer(sublinear_tf=True), LogisticRegression(C=10, max_iter=1000))
+
+
+def escalation_curve(probabilities, teacher_labels, thresholds=THRESHOLDS):
+    """
+    Measures the escalation rate and the agreement of the cascade with the transformer for every threshold.
+    :param probabilities: np.ndarray
+        first-stage probabilities of held out sentences
+    :param teacher_labels: np.ndarray[int]
+        labels the transformer predicts for the same sentences
+    :param thresholds: Iterable[float]
+        thresholds to measure
+    :return: List[Tuple[float, float, float]]
+        threshold, escalation rate and agreement of every threshold
+    """
+    confidence = probabilities.max(axis=1)
+    agrees = probabilities.argmax(axis=1) == teacher_labels
+    return [(float(threshold), float(np.mean(confidence < threshold)),
+             float(np.mean(agrees | (confidence < threshold)))) for threshold in thresholds]
+
+
+def choose_threshold(curve, target_agreement=0.99):
+    """
+    :param curve: List[Tuple[float, float, float]]
+        threshold, escalation rate and agreement, see escalation_curve()
+    :param target_agreement: float
+        minimum agreement of the cascade with the transformer
+    :return: float
+        the threshold with the lowest escalation rate that reaches the target, the highest threshold otherwise
+    """
+    reached = [(escalation, threshold) for threshold, escalation, agreement in curve if agreement >= target_agreement]
+    return min(reached)[1] if reached else max(threshold for threshold, _, _ in curve)
+
+
+def train_cascade(sentences, teacher_labels, labeled_sentences=(), labels=(), target_agreement=0.99,
+                  held_out=0.2, seed=42):
+    """
+    Distills the first stage from the transformer predictions and the manually labeled sentences and chooses its
+    threshold on held out sentences.
+    :param sentences: List[str]
+        unlabeled sentences, e.g. a sample of the classification set
+    :param teacher_labels: np.ndarray[int]
+        labels the transformer predicts for the sentences
+    :param labeled_sentences: List[str]
+        manually labeled sentences
+    :param labels: np.ndarray[int]
+        labels of the manually labeled sentences
+    :param target_agreement: float
+        minimum agreement of the cascade with the transformer on the held out sentences
+    :param held_out: float
+        share of the sentences used to measure the curve instead of training
+    :param seed: int
+        random state of the split
+    :return: Cascade
+        the trained cascade
+    """
+    train_sentences, test_sentences, train_labels, test_labels = train_test_split(
+        list(sentences), np.asarray(teacher_labels), test_size=held_out, random_state=seed)
+    pipeline = first_stage().fit(train_sentences + list(labeled_sentences),
+                                 np.concatenate([train_labels, np.asarray(labels, dtype=train_labels.dtype)]))
+    curve = escalation_curve(pipeline.predict_proba(test_sentences), test_labels)
+    return Cascade(pipeline, choose_threshold(curve, target_agreement), curve)
+
+
+def cascade_predict_proba(cascade, sentences, predict_fn):
+    """
+    Computes class probabilities with the cascade, only escalated sentences are passed to the transformer.
+    :param cascade: Cascade
+        the first stage
+    :param sentences: List[str]
+        sentences to predict
+    :param predict_fn: Callable
+        computes the transformer probabilities of a list of sentences
+    :return: np.ndarray
+        probabilities of shape (number of sentences, number of classes)
+    :return: int
+        number of escalated sentences
+    """
+    probabilities, escalate = cascade.split(sentences)
+    escalated = np.flatnonzero(escalate)
+    if len(escalated):
+        probabilities[escalated] = predict_fn([sentences[i] for i in escalated])
+    return probabilities, len(escalated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the first stage of the future statement cascade.")
+    parser.add_argument('--import_data', nargs="?", default="data/classification_set.pkl", action='store',
+                        help='Sentences the transformer predictions are distilled from.')
+    parser.add_argument('--labeled', default="data/candidates_labeled.pkl",
+                        help='Manually labeled sentences added to the training data.')
+    parser.add_argument('--distill_size', type=int, default=20000,
+                        help='Maximum number of sentences predicted by the transformer.')
+    parser.add_argument('--target_agreement', type=float, default=0.99,
+                        help='Minimum agreement of the cascade with the transformer.')
+    parser.add_argument('--save_cascade', default=CASCADE_PATH, help='Path of the trained cascade.')
+    parser.add_argument('--model', nargs="?", action='store',
+                        help='Transformer checkpoint or classifier-only export (default: the export if it exists).')
+    parser.add_argument('--cache', nargs="?", const="data/inference_cache.sqlite", action='store',
+                        help='Read and write transformer predictions from and to a given cache database.')
+    parser.add_argument('--batch_size', type=int, default=32, help='Maximum number of sentences per forward pass.')
+    args = parser.parse_args()
+
+    # the cascade has to be pickled as cascade.Cascade instead of __main__.Cascade to be loadable elsewhere
+    from cascade import train_cascade
+    from chunked_io import iter_batches, read_data
+    from future_inference import default_model_path, load_model
+    from inference_cache import InferenceCache, cached_predict_proba, model_id
+    from inference_engine import Predictor
+
+    model_path = args.model or default_model_path()
+    sentences = next(iter_batches(args.import_data, args.distill_size))["candidate"].values.tolist()
+    predictor = Predictor(functools.partial(load_model, model_path), batch_size=args.batch_size)
+    cache = InferenceCache(args.cache, model_id(model_path)) if args.cache else None
+    teacher_labels = cached_predict_proba(cache, sentences, predictor.predict, predictor.num_labels).argmax(axis=1)
+    predictor.close()
+    labeled = read_data(args.labeled)
+
+    cascade = train_cascade(sentences, teacher_labels, labeled["candidate"].values.tolist(),
+                            labeled["label"].values.astype(int), args.target_agreement)
+    print("threshold escalation agreement")
+    for threshold, escalation, agreement in cascade.curve:
+        print(f"{threshold:.2f} {escalation:.3f} {agreement:.4f}")
+    cascade.save(args.save_cascade)
+    print(f"threshold {cascade.threshold:.2f} saved to {args.save_cascade}")
@@ -0,0 +1,238 @@
+import argparse
+import glob
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# completed input row ranges of a chunked dataset, see ChunkedWriter
+MANIFEST_NAME = "_manifest.json"
+
+
+def list_parts(path):
+    """
+    Lists the part files of a chunked dataset.
+    :param path: str
+        path to a .parquet file or to a directory of .parquet part files
+    :return: List[str]
+        sorted paths of the part files
+    """
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+    return [path]
+
+
+def iter_batches(path, batch_size=10000):
+    """
+    Reads a dataset batch by batch. Parquet files are streamed, so that only one batch has to fit into memory.
+    Pickled DataFrames are still supported, but have to be loaded completely first.
+    :param path: str
+        path to a .pkl file, a .parquet file or a directory of .parquet part files
+    :param batch_size: int
+        maximum number of rows per batch
+    :return: Iterator[DataFrame]
+        batches of the dataset
+    """
+    for _, _, batch in iter_ranges(path, batch_size):
+        yield batch
+
+
+def iter_ranges(path, batch_size=10000, skip=None):
+    """
+    Reads a dataset batch by batch together with the row range of every batch. The ranges only depend on the dataset
+    and the batch size, so that they are the same in every run. Part files whose batches are all skipped aren't read.
+    :param path: str
+        path to a .pkl file, a .parquet file or a directory of .parquet part files
+    :param batch_size: int
+        maximum number of rows per batch
+    :param skip: Callable
+        gets the first and the last + 1 row of a batch and returns True if the batch isn't needed
+    :return: Iterator[Tuple[int, int, DataFrame]]
+        first row, last row + 1 and rows of every batch that isn't skipped
+    """
+    skip = skip or (lambda start, end: False)
+    if path.endswith(".pkl"):
+        data = pd.read_pickle(path).reset_index(drop=True)
+        for start in range(0, len(data), batch_size):
+            end = min(start + batch_size, len(data))
+            if not skip(start, end):
+                yield start, end, data.iloc[start:end]
+        return
+    offset = 0
+    for part in list_parts(path):
+        parquet_file = pq.ParquetFile(part)
+        n_rows = parquet_file.metadata.num_rows
+        ranges = [(start, min(start + batch_size, offset + n_rows)) for start in range(offset, offset + n_rows, batch_size)]
+        if not all(skip(start, end) for start, end in ranges):
+            for (start, end), batch in zip(ranges, parquet_file.iter_batches(batch_size=batch_size)):
+                if not skip(start, end):
+                    yield start, end, batch.to_pandas()
+        offset += n_rows
+
+
+def count_rows(path):
+    """
+    Counts the rows of a dataset, Parquet files only need to be read from their metadata.
+    :param path: str
+        path to a .pkl file, a .parquet file or a directory of .parquet part files
+    :return: int
+        number of rows
+    """
+    if path.endswith(".pkl"):
+        return len(pd.read_pickle(path))
+    return sum(pq.ParquetFile(part).metadata.num_rows for part in list_parts(path))
+
+
+def read_data(path):
+    """
+    Reads a complete dataset into one DataFrame.
+    :param path: str
+        path to a .pkl file, a .parquet file or a directory of .parquet part files
+    :return: DataFrame
+        the dataset with a fresh index
+    """
+    if path.endswith(".pkl"):
+        return pd.read_pickle(path)
+    parts = [pq.read_table(part) for part in list_parts(path)]
+    return pa.concat_tables(parts).to_pandas() if parts else pd.DataFrame()
+
+
+def write_data(data, path):
+    """
+    Writes a complete DataFrame, either pickled or as a chunked dataset with a single part.
+    :param data: DataFrame
+        the data to write
+    :param path: str
+        path ending with .pkl or a directory for the .parquet part files
+    """
+    with ChunkedWriter(path) as writer:
+        writer.write(data)
+
+
+class ChunkedWriter:
+    """
+    Writes a dataset batch by batch into a directory of Parquet part files, every batch becomes one part file.
+    Every finished part stays readable if the process gets killed, unlike a single Parquet file whose footer is written
+    at the very end. For paths ending with .pkl the batches are collected and pickled on close instead.
+    The row ranges of the input that are completely written are recorded in a manifest next to the part files, so that
+    a killed run can be resumed without repeating them.
+    """
+
+    def __init__(self, path, resume=False, settings=None):
+        """
+        :param path: str
+            directory for the part files or path ending with .pkl
+        :param resume: Boolean
+            keep the part files of an earlier run listed in its manifest, otherwise all existing part files are removed
+        :param settings: dict
+            settings of the run that determine the row ranges (e.g. input path and chunk size), a resumed run needs
+            the same settings as the earlier one
+        """
+        self.path = path
+        self.pickled_batches = [] if path.endswith(".pkl") else None
+        self.manifest = {"settings": settings, "completed": []}
+        self.n_parts = 0
+        if self.pickled_batches is not None:
+            if resume:
+                print(f"{path} is written at the end of the run, resuming requires a .parquet directory")
+            return
+
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST_NAME)
+        if resume and os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf8") as f:
+                manifest = json.load(f)
+            if manifest["settings"] != settings:
+                raise ValueError(f"{path} was written with the settings {manifest['settings']}, resume with the same "
+                                 f"settings or start a new run")
+            self.manifest = manifest
+        kept_parts = {os.path.join(path, part) for _, _, part in self.manifest["completed"] if part}
+        # parts of chunks that were interrupted before the manifest got updated would be written twice
+        for part in list_parts(path) + glob.glob(os.path.join(path, "*.tmp")):
+            if part not in kept_parts:
+                os.remove(part)
+        self.n_parts = max((int(part[len("part-"):-len(".parquet")]) + 1
+                            for _, _, part in self.manifest["completed"] if part), default=0)
+        self.completed_ranges = {(start, end) for start, end, _ in self.manifest["completed"]}
+        self.save_manifest()
+
+    def completed(self, start, end):
+        """
+        :param start: int
+            first row of an input range
+        :param end: int
+            last row + 1 of an input range
+        :return: Boolean
+            True if the output of the input range was written by this or an earlier run
+        """
+        return self.pickled_batches is None and (start, end) in self.completed_ranges
+
+    def write(self, batch, rows=None):
+        """
+        Appends a batch to the dataset.
+        :param batch: DataFrame
+            rows to append, may be empty if no row of the input range is kept
+        :param rows: Tuple[int, int]
+            first and last + 1 row of the input range the batch was created from, recorded as completed
+        """
+        if self.pickled_batches is not None:
+            self.pickled_batches.append(batch)
+            return
+        part_name = None
+        if not batch.empty:
+            part_name = f"part-{self.n_parts:06d}.parquet"
+            part = os.path.join(self.path, part_name)
+            # write to a temporary name first, so that a killed process never leaves a truncated part behind
+            batch.reset_index(drop=True).to_parquet(part + ".tmp", index=False)
+            os.replace(part + ".tmp", part)
+            self.n_parts += 1
+        if rows is not None:
+            self.manifest["completed"].append([rows[0], rows[1], part_name])
+            self.completed_ranges.add(tuple(rows))
+            self.save_manifest()
+
+    def save_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        with open(manifest_path + ".tmp", "w", encoding="utf8") as f:
+            json.dump(self.manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def close(self):
+        if self.pickled_batches is not None:
+            data = pd.concat(self.pickled_batches, ignore_index=True) if self.pickled_batches else pd.DataFrame()
+            data.to_pickle(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def convert(pkl_path, output_path, rows_per_part=100000):
+    """
+    Converts a pickled DataFrame into a chunked Parquet dataset.
+    :param pkl_path: str
+        path to the pickled DataFrame
+    :param output_path: str
+        directory for the part files
+    :param rows_per_part: int
+        number of rows per part file
+    """
+    with ChunkedWriter(output_path) as writer:
+        for batch in iter_batches(pkl_path, rows_per_part):
+            writer.write(batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert pickled DataFrames into chunked Parquet datasets.")
+    parser.add_argument("--convert", nargs=2, action="store",
+                        help="Convert a given .pkl file into a directory of .parquet part files.")
+    parser.add_argument("--rows_per_part", type=int, default=100000, help="Number of rows per part file.")
+    args = parser.parse_args()
+
+    if args.convert:
+        convert(args.convert[0], args.convert[1], args.rows_per_part)
+        print(f"{count_rows(args.convert[1])} rows written to {args.convert[1]}")
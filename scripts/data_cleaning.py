@@ -1,25 +1,153 @@
 import argparse
+import collections
+import hashlib
+import itertools
+import multiprocessing
 import re
 import os
+import sys
+import time
+from array import array
 
+from candidate_shards import parse_shard_lines
 
-def read_sentence(file):
+NBSP = "\u00a0"
+LEADING_CHARS = re.compile(r"^[^[a-zA-Z1-9(“'\"]*")
+HTML = re.compile(r"<[^<]+?>")
+
+
+class FingerprintSet:
     """
-    Read textfile and pass every line to clean_sentence method.
-    :param file: str
-        path to textfile with sentences
-    :return: list
-        with cleaned sentences
+    Fixed-size hash set of 64-bit sentence fingerprints (blake2b) with open addressing.
+    Needs 8 bytes per slot, independent of the length of the sentences, and never grows beyond the size reserved for
+    the given capacity: the smallest power of two of at least 4/3 slots per sentence, i.e. 10.7 to 21.3 bytes per
+    sentence (256 MiB for the default capacity of 2^24).
     """
-    try:
-        cleaned_sentences = []
-        with open(file, "r", encoding="utf-8") as uncleaned_text:
-            text = uncleaned_text.readlines()
-            for sentence in text:
-                cleaned_sentences.append(clean_sentence(sentence))
-        return cleaned_sentences
-    except IOError as e:
-        print(f"An error occurred while opening {file}: {e}")
+
+    def __init__(self, capacity):
+        """
+        :param capacity: int
+            maximum number of unique sentences, the table gets at most 75% full
+        """
+        size = 1
+        while size * 3 < capacity * 4:
+            size *= 2
+        self.capacity = capacity
+        self.mask = size - 1
+        self.slots = array("Q", [0]) * size
+        self.count = 0
+
+    def add(self, fingerprint):
+        """
+        Adds a fingerprint to the set.
+        :param fingerprint: int
+            non-zero 64-bit fingerprint of a sentence
+        :return: Boolean
+            True if the fingerprint wasn't in the set before
+        """
+        slot = fingerprint & self.mask
+        while self.slots[slot]:
+            if self.slots[slot] == fingerprint:
+                return False
+            slot = (slot + 1) & self.mask
+        if self.count >= self.capacity:
+            raise OverflowError(f"More than {self.capacity} unique sentences, increase --dedup_capacity.")
+        self.slots[slot] = fingerprint
+        self.count += 1
+        return True
+
+
+def fingerprint(sentence):
+    """
+    Computes the 64-bit fingerprint of a sentence.
+    :param sentence: str
+        sentence to hash
+    :return: int
+        non-zero fingerprint, 0 marks an empty slot in a FingerprintSet
+    """
+    return int.from_bytes(hashlib.blake2b(sentence.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+def list_input_files(input_dir):
+    """
+    Lists all .txt files and .jsonl shards of a directory in a fixed order.
+    :param input_dir: str
+        directory with candidate files
+    :return: List[str]
+        sorted paths of the candidate files
+    """
+    return [os.path.join(input_dir, input_file) for input_file in sorted(os.listdir(input_dir))
+            if input_file.endswith(".txt") or input_file.endswith(".jsonl")]
+
+
+def read_line_batches(files, batch_size):
+    """
+    Reads candidate files lazily in batches of lines.
+    :param files: List[str]
+        paths to .txt files or .jsonl shards
+    :param batch_size: int
+        number of lines per batch
+    :return: Iterator[tuple]
+        path of the file and a list of its lines
+    """
+    for file in files:
+        try:
+            with open(file, "r", encoding="utf-8") as uncleaned_text:
+                while True:
+                    lines = list(itertools.islice(uncleaned_text, batch_size))
+                    if not lines:
+                        break
+                    yield file, lines
+        except IOError as e:
+            print(f"An error occurred while opening {file}: {e}")
+
+
+def clean_lines(batch):
+    """
+    Passes every sentence of a batch of lines to clean_sentence method and fingerprints the non-empty results. Lines of
+    .jsonl shards get parsed first.
+    :param batch: tuple
+        path of the file and a list of its lines
+    :return: List[tuple]
+        fingerprint (int) and cleaned sentence (str) without trailing newline
+    """
+    file, lines = batch
+    if file.endswith(".jsonl"):
+        sentences = (sentence for record in parse_shard_lines(lines, file) for sentence in record["sentences"])
+    else:
+        sentences = lines
+    cleaned_sentences = (clean_sentence(sentence).rstrip("\n") for sentence in sentences)
+    return [(fingerprint(sentence), sentence) for sentence in cleaned_sentences if sentence]
+
+
+def clean_files(files, workers=1, batch_size=10000):
+    """
+    Cleans all sentences of the given files, optionally spread across a pool of processes.
+    The cleaned sentences are returned in the same order for any number of workers.
+    :param files: List[str]
+        paths to .txt files or .jsonl shards
+    :param workers: int
+        number of processes, 1 cleans in the current process
+    :param batch_size: int
+        number of lines sent to a worker at once
+    :return: Iterator[tuple]
+        fingerprint (int) and cleaned sentence (str) without trailing newline
+    """
+    batches = read_line_batches(files, batch_size)
+    if workers <= 1:
+        for batch in batches:
+            yield from clean_lines(batch)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        # bounded number of batches in flight, so that memory doesn't grow with the corpus size
+        in_flight = collections.deque()
+        for batch in batches:
+            in_flight.append(pool.apply_async(clean_lines, (batch,)))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().get()
+        while in_flight:
+            yield from in_flight.popleft().get()
 
 
 def clean_sentence(sentence):
@@ -30,47 +158,93 @@ def clean_sentence(sentence):
     :return: str
         cleaned sentence
     """
-    nbsp = " "
-    leading_chars = r"^[^[a-zA-Z1-9(“'\"]*"
-    html = r"<[^<]+?>"
-
-    sentence = sentence.replace(nbsp, " ")
-    sentence = re.sub(leading_chars, "", sentence)
-    sentence = re.sub(html, "", sentence)
+    sentence = sentence.replace(NBSP, " ")
+    sentence = LEADING_CHARS.sub("", sentence)
+    sentence = HTML.sub("", sentence)
     return sentence
 
 
-def write_data(sentence_set, output):
+def deduplicate(sentences, capacity):
+    """
+    Drops every repetition of a sentence, keeps the order of the first occurrences.
+    :param sentences: Iterable[tuple]
+        fingerprint (int) and cleaned sentence (str)
+    :param capacity: int
+        maximum number of unique sentences
+    :return: Iterator[str]
+        unique sentences
+    """
+    fingerprints = FingerprintSet(capacity)
+    for sentence_fingerprint, sentence in sentences:
+        if fingerprints.add(sentence_fingerprint):
+            yield sentence
+
+
+def write_data(sentences, output):
     """
     Writes cleaned sentences into specified output file.
-    :param sentence_set: set
-        set of sentences without duplicates
+    :param sentences: Iterable[str]
+        sentences without duplicates
     :param output:
         path where output file should be saved
+    :return: int
+        number of written sentences
     """
+    n_sentences = 0
     try:
-        cleaned_sentences = open(f"{output}.txt", "w", encoding="utf-8")
-        for sentence in sentence_set:
-            cleaned_sentences.writelines(sentence)
-        cleaned_sentences.close()
+        with open(f"{output}.txt", "w", encoding="utf-8") as cleaned_sentences:
+            for sentence in sentences:
+                cleaned_sentences.write(sentence + "\n")
+                n_sentences += 1
     except IOError as e:
         print(f"An error occurred while writing {output}.txt: {e}")
+    return n_sentences
+
+
+def benchmark_cleaning(files, workers, capacity):
+    """
+    Compares the throughput of serial cleaning with the cleaning spread across a pool of processes.
+    :param files: List[str]
+        paths to .txt files or .jsonl shards
+    :param workers: int
+        number of processes of the parallel run
+    :param capacity: int
+        maximum number of unique sentences
+    """
+    n_lines = sum(len(lines) for _, lines in read_line_batches(files, 10000))
+    results = {}
+    for n in sorted({1, workers}):
+        start = time.perf_counter()
+        sentences = list(deduplicate(clean_files(files, n), capacity))
+        duration = time.perf_counter() - start
+        results[n] = sentences
+        print(f"{n} worker(s): {n_lines / duration:.0f} lines/s, {len(sentences)} unique sentences")
+    print(f"identical output: {results[1] == results[workers]}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Clean candidate sentences for further processing.")
 
     parser.add_argument("--clean_data", nargs=2,
-                        help="Read .txt files from given path. Cleans and combines the content to output file.")
+                        help="Read .txt files and .jsonl shards from given path. Cleans and combines the content to "
+                             "output file.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes the cleaning is spread across.")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Compare the throughput of one and --workers processes instead of writing the output.")
+    parser.add_argument("--dedup_capacity", type=int, default=2 ** 24,
+                        help="Maximum number of unique sentences, reserves 10.7-21.3 bytes per sentence for "
+                             "deduplication (256 MiB for the default of 2^24).")
     args = parser.parse_args()
 
     input_dir = args.clean_data[0]
     output_file = args.clean_data[1]
 
-    sentences = []
-    for input_file in os.listdir(input_dir):
-        if input_file.endswith(".txt"):
-            sentences = [*sentences, *read_sentence(input_dir + input_file)]
+    input_files = list_input_files(input_dir)
+    if args.benchmark:
+        benchmark_cleaning(input_files, args.workers, args.dedup_capacity)
+        sys.exit(0)
 
-    if sentences:
-        write_data(set(sentences), input_dir + output_file)
+    sentences = clean_files(input_files, args.workers)
+    n_written = write_data(deduplicate(sentences, args.dedup_capacity), os.path.join(input_dir, output_file))
+    print(f"{n_written} unique sentences written to {os.path.join(input_dir, output_file)}.txt")
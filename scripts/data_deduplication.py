@@ -0,0 +1,184 @@
+import argparse
+import re
+import sys
+import zlib
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from chunked_io import read_data
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+NORMALIZE_DIGITS = re.compile(r"[0-9]")
+NORMALIZE_PUNCTUATION = re.compile(r"[\W_]+")
+
+
+class MinHashLSH:
+    """
+    Clusters near-duplicate sentences with MinHash signatures over character shingles and locality sensitive hashing.
+    Sentences are assigned greedily in order of appearance: a sentence joins the cluster of the first representative
+    whose estimated Jaccard similarity reaches the threshold, otherwise it becomes a new representative itself.
+    Only the signatures of representatives are kept in the LSH buckets.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5, seed=42):
+        """
+        :param threshold: float
+            minimum estimated Jaccard similarity of two sentences in the same cluster
+        :param num_perm: int
+            number of hash permutations of a signature
+        :param shingle_size: int
+            number of characters per shingle
+        :param seed: int
+            seed of the hash permutations
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self.b = generator.randint(0, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self.buckets = [defaultdict(list) for _ in range(self.bands)]
+        self.signatures = []
+
+    def signature(self, sentence):
+        """
+        Computes the MinHash signature of a sentence. Digits are unified and punctuation is dropped before shingling,
+        so that sentences which only differ in a date or a number get (nearly) identical signatures.
+        :param sentence: str
+            sentence to hash
+        :return: np.ndarray
+            signature with num_perm uint32 values
+        """
+        text = NORMALIZE_PUNCTUATION.sub(" ", NORMALIZE_DIGITS.sub("0", sentence.lower())).strip()
+        shingles = {text[i:i + self.shingle_size] for i in range(max(len(text) - self.shingle_size + 1, 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64,
+                             count=len(shingles))
+        permuted = (self.a * hashes + self.b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def add(self, sentence):
+        """
+        Assigns a sentence to the cluster of a similar representative or makes it a new representative.
+        :param sentence: str
+            sentence to assign
+        :return: int
+            index of the representative in order of creation
+        """
+        signature = self.signature(sentence)
+        keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        checked = set()
+        for band, key in enumerate(keys):
+            for representative in self.buckets[band].get(key, ()):
+                if representative in checked:
+                    continue
+                checked.add(representative)
+                if np.mean(self.signatures[representative] == signature) >= self.threshold:
+                    return representative
+
+        representative = len(self.signatures)
+        self.signatures.append(signature)
+        for band, key in enumerate(keys):
+            self.buckets[band][key].append(representative)
+        return representative
+
+
+def optimal_bands(threshold, num_perm):
+    """
+    Chooses the LSH banding whose similarity threshold (1/bands)^(1/rows) is closest to the given threshold.
+    :param threshold: float
+        minimum Jaccard similarity of two sentences in the same cluster
+    :param num_perm: int
+        number of hash permutations of a signature
+    :return: int
+        number of bands
+    :return: int
+        number of rows per band
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+def near_dedup(path, output_name, threshold, num_perm):
+    """
+    Reads sentences separated with a newline from a given textfile, keeps one representative per cluster of
+    near-duplicates and saves a mapping of every sentence to its representative.
+    :param path: str
+        path to textfile with sentences
+    :param output_name: str
+        filename of the output textfile and mapping DataFrame
+    :param threshold: float
+        minimum estimated Jaccard similarity of two sentences in the same cluster
+    :param num_perm: int
+        number of hash permutations of a signature
+    :return: DataFrame
+        with columns "candidate" (str) and "representative" (str)
+    """
+    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+    representatives = []
+    mapping = {'candidate': [], 'representative': []}
+
+    print('clustering sentences...')
+    with open(path, 'r', encoding='utf8') as f:
+        for line in f:
+            sentence = line.strip()
+            if not sentence:
+                continue
+            representative = lsh.add(sentence)
+            if representative == len(representatives):
+                representatives.append(sentence)
+            mapping['candidate'].append(sentence)
+            mapping['representative'].append(representatives[representative])
+
+    print('{} sentences, {} representatives ({:.1%} less inference volume)'.format(
+        len(mapping['candidate']), len(representatives), 1 - len(representatives) / max(len(mapping['candidate']), 1)))
+    with open('data/{}.txt'.format(output_name), 'w', encoding='utf8') as f:
+        for sentence in representatives:
+            f.write(sentence + '\n')
+    df = pd.DataFrame(data=mapping, columns=['candidate', 'representative'])
+    df.to_pickle('data/{}_clusters.pkl'.format(output_name))
+    return df
+
+
+def propagate_labels(classified, mapping):
+    """
+    Copies the labels of every classified representative to all sentences of its cluster.
+    :param classified: DataFrame
+        classified representatives with column "candidate" and any label columns
+    :param mapping: DataFrame
+        with columns "candidate" and "representative"
+    :return: DataFrame
+        with one row per sentence of the mapping and the label columns of its representative
+    """
+    labels = classified.drop_duplicates('candidate').rename(columns={'candidate': 'representative'})
+    propagated = mapping.merge(labels, on='representative', how='left')
+    return propagated.drop(columns='representative')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remove near-duplicate candidate sentences before classification.')
+    parser.add_argument('--near_dedup', nargs=2, action='store',
+                        help='Read sentences from a given textfile and save one representative per cluster of '
+                             'near-duplicates to data/OUTPUT_NAME.txt and the mapping to data/OUTPUT_NAME_clusters.pkl.')
+    parser.add_argument('--threshold', type=float, default=0.8,
+                        help='Minimum estimated Jaccard similarity of sentences in the same cluster.')
+    parser.add_argument('--num_perm', type=int, default=128, help='Number of hash permutations of a signature.')
+    parser.add_argument('--propagate', nargs=3, action='store',
+                        help='Copy the labels of a classified DataFrame of representatives to all sentences of a '
+                             'mapping and save the result to a given path.')
+    args = parser.parse_args()
+
+    if args.near_dedup:
+        near_dedup(args.near_dedup[0], args.near_dedup[1], args.threshold, args.num_perm)
+
+    if args.propagate:
+        try:
+            classified_data = read_data(args.propagate[0])
+            mapping_data = pd.read_pickle(args.propagate[1])
+        except FileNotFoundError:
+            print('File not found.')
+            sys.exit(1)
+        propagate_labels(classified_data, mapping_data).to_pickle(args.propagate[2])
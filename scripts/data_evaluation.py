@@ -3,6 +3,8 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+from chunked_io import read_data
+
 
 def plot_emotions_distribution(plt_data, drop_neutral=False):
     """
@@ -69,7 +71,7 @@ if __name__ == '__main__':
                        help='Plot confidence of emotion classes.')
     args = parser.parse_args()
 
-    data = pd.read_pickle(args.input_file[0])
+    data = read_data(args.input_file[0])
     emotions = data.iloc[:, 2:]
 
     # calculate distribution of classes, setup dataframes with assigned classes and confidences
@@ -1,70 +1,129 @@
+import os
 import sys
 import numpy as np
 import pandas as pd
 import argparse
 
+from chunked_io import ChunkedWriter, count_rows, iter_batches, read_data
+from inference_cache import sentence_hash
+from label_journal import JOURNAL_PATH, LabelJournal, compact, labeled_hashes
 
-def import_data(path, output_name):
+# labeling tool name in the label journal
+JOURNAL_SOURCE = 'data_preprocessing'
+# a .parquet directory is written batch by batch, a .pkl file only at the end
+UNLABELED_PATH = 'data/candidates_unlabeled.parquet'
+
+
+def import_data(path, output_name, rows_per_part=100000):
     """
-    Reads sentences seperated with a newline from a given textfile and writes them into a DataFrame that gets saved.
+    Reads sentences seperated with a newline from a given textfile line by line and writes them chunk by chunk into
+    data/OUTPUT_NAME.parquet, so that only one chunk has to fit into memory.
     :param path: str
         path to textfile with sentences
     :param output_name: str
         filename of output DataFrame
-    :return: DataFrame
-        with columns "candidates" (str) containing the sentences and "labels" (int16) containing 0s.
+    :param rows_per_part: int
+        number of sentences per part file
+    :return: str
+        path of the dataset with columns "candidates" (str) containing the sentences and "labels" (int16) containing 1s
     """
+    output_path = 'data/{}.parquet'.format(output_name)
     print('importing text file...')
-    f = open(path, 'r', encoding='utf8')
-    lines = f.readlines()
-    f.close()
-
-    data = {'candidate': [], 'label': []}
+    with open(path, 'r', encoding='utf8') as f, ChunkedWriter(output_path) as writer:
+        candidates = []
+        for line in f:
+            if len(line) > 1:
+                candidates.append(line.strip())
+            if len(candidates) == rows_per_part:
+                writer.write(candidate_frame(candidates))
+                candidates = []
+        writer.write(candidate_frame(candidates))
+    print('{} sentences saved to {}'.format(count_rows(output_path), output_path))
+    return output_path
 
-    print('creating df...')
-    for index, line in enumerate(lines):
-        if len(line) > 1:
-            data['candidate'].append(line.strip())
-            data['label'].append(1)
-    df = pd.DataFrame(data=data, columns=['candidate', 'label']).astype({'candidate': str, 'label': np.dtype('int16')})
 
-    print('saving df as pickle...')
-    df.to_pickle('data/{}.pkl'.format(output_name))
-    return df
+def candidate_frame(candidates):
+    """
+    :param candidates: List[str]
+        sentences
+    :return: DataFrame
+        with columns "candidates" (str) containing the sentences and "labels" (int16) containing 1s
+    """
+    return pd.DataFrame(data={'candidate': candidates, 'label': 1}, columns=['candidate', 'label']) \
+        .astype({'candidate': str, 'label': np.dtype('int16')})
 
 
-def split_data(size, data):
+def split_data(size, path, unlabeled_path=UNLABELED_PATH, seed=42):
     """
-    Shuffles a given DataFrame and splits it into two sets. The first one gets returned for the labeling process and
-    the second one saved as data/candidates_unlabeled.pkl.
+    Draws a uniform random set of a given size from a dataset for the labeling process by reservoir sampling in a
+    single pass and writes all other rows to unlabeled_path. Only the sample and one batch are held in memory if
+    unlabeled_path is a .parquet directory, a .pkl file keeps all other rows in memory until it is written.
     :param size: int
         size of the first set
-    :param data: DataFrame
-        data to be split
+    :param path: str
+        path to the dataset (.pkl, .parquet file or directory of .parquet part files)
+    :param unlabeled_path: str
+        path of the second set (.pkl or .parquet directory)
+    :param seed: int
+        seed of the sampling, the same seed draws the same set again, e.g. to continue labeling
     :return: DataFrame
-        first DF resulting of the split
+        first DF resulting of the split, in random order
     """
-    shuffled = data.sample(frac=1).reset_index(drop=True)
-    data_slice = shuffled.loc[:size - 1, :]
-    data_slice_unlabeled = shuffled.loc[size:, :]
-    data_slice_unlabeled.to_pickle('data/candidates_unlabeled.pkl')
-    return data_slice
+    rng = np.random.default_rng(seed)
+    # rows of the sample indexed by their reservoir slot, kept as a DataFrame so that the dtypes of the input remain
+    reservoir = None
+    seen = 0
+    with ChunkedWriter(unlabeled_path) as writer:
+        for batch in iter_batches(path):
+            batch = batch.reset_index(drop=True)
+            if reservoir is None:
+                reservoir = batch.iloc[:0]
+            positions = seen + np.arange(len(batch))
+            # row number t replaces a random slot of the reservoir with probability size / (t + 1)
+            slots = np.where(positions < size, positions, rng.integers(0, positions + 1))
+            accepted = np.flatnonzero(slots < size)
+            # of several rows of the batch for the same slot, the last one replaces the others
+            _, last = np.unique(slots[accepted][::-1], return_index=True)
+            winners = accepted[::-1][last]
+            winner_slots = slots[winners]
+            evicted = reservoir.loc[reservoir.index.intersection(winner_slots)]
+            reservoir = pd.concat([reservoir.drop(winner_slots, errors='ignore'),
+                                   batch.iloc[winners].set_axis(winner_slots)])
+            unlabeled = pd.concat([batch.drop(winners), evicted], ignore_index=True).astype(batch.dtypes)
+            writer.write(unlabeled)
+            seen += len(batch)
 
+    if reservoir is None:
+        return pd.DataFrame(columns=['candidate', 'label'])
+    data_slice = reservoir.sort_index().reset_index(drop=True)
+    n_unlabeled = count_rows(unlabeled_path)
+    if len(data_slice) + n_unlabeled != seen:
+        raise ValueError('split of {} rows into {} + {} rows is incomplete'.format(seen, len(data_slice), n_unlabeled))
+    return data_slice.iloc[rng.permutation(len(data_slice))].reset_index(drop=True)
 
-def label_data(data):
+
+def label_data(data, journal_path=JOURNAL_PATH):
     """
-    Prints each sentence of a given DataFrame to the CLI and saves the user input as associated label.
+    Prints each sentence of a given DataFrame to the CLI and appends the user input as associated label to the label
+    journal. Sentences that are already labeled in the journal are skipped, so that an interrupted session restarts at
+    the first unlabeled row. Finally the labels of this tool are compacted into data/candidates_labeled.pkl.
     :param data: DataFrame
         containing candidates
+    :param journal_path: str
+        path to the label journal
     """
-    for index, row in data.iterrows():
-        print('---Candidate {}---'.format(index))
-        print(row['candidate'])
-        label = ''
-        while not label.isnumeric():
-            label = input('label: ')
-        data.at[index, 'label'] = label
-    data.to_pickle('data/candidates_labeled.pkl')
+    labeled = labeled_hashes(journal_path, [JOURNAL_SOURCE])
+    with LabelJournal(journal_path) as journal:
+        for index, candidate in enumerate(data['candidate'].values):
+            if sentence_hash(candidate) in labeled:
+                continue
+            print('---Candidate {}---'.format(index))
+            print(candidate)
+            label = ''
+            while not label.isnumeric():
+                label = input('label: ')
+            journal.append(candidate, int(label), JOURNAL_SOURCE)
+    compact(journal_path, 'data/candidates_labeled.pkl', [JOURNAL_SOURCE])
 
 
 if __name__ == '__main__':
@@ -74,31 +133,38 @@ if __name__ == '__main__':
     parser.add_argument('--start_labeling', nargs=1, action='store',
                         help='Slice a set of a given size out of the original dataset and present every sentence for '
                              'a manual labeling process.')
+    parser.add_argument('--save_unlabeled', default=UNLABELED_PATH,
+                        help='Path of the candidates that are not sliced out by --start_labeling (.pkl or .parquet '
+                             'directory).')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Seed of the slice drawn by --start_labeling, the same seed continues a labeling session.')
+    parser.add_argument('--rows_per_part', type=int, default=100000,
+                        help='Number of rows per part file of --import_data.')
     parser.add_argument('--show_data', nargs=1, action='store', help='Prints the head of a given DataFrame.')
     parser.add_argument('--count_classes', nargs=1, action='store',
                         help='Counts all candidates belonging to the classes 1 and 0 of a given DataFrame.')
     args = parser.parse_args()
 
     if args.import_data:
-        candidates = import_data(args.import_data[0], args.import_data[1])
+        candidates_path = import_data(args.import_data[0], args.import_data[1], args.rows_per_part)
     else:
-        try:
-            candidates = pd.read_pickle('data/candidates.pkl')
-        except FileNotFoundError:
-            print('No pickled data available. Use --import argument.')
-            sys.exit(1)
+        candidates_path = 'data/candidates.parquet' if os.path.isdir('data/candidates.parquet') \
+            else 'data/candidates.pkl'
 
     if args.start_labeling:
-        candidates_split = split_data(int(args.start_labeling[0]), candidates)
+        if not os.path.exists(candidates_path):
+            print('No imported data available. Use --import argument.')
+            sys.exit(1)
+        candidates_split = split_data(int(args.start_labeling[0]), candidates_path, args.save_unlabeled, args.seed)
         label_data(candidates_split)
 
     if args.show_data:
         try:
-            print(pd.read_pickle(args.show_data[0]).head)
+            print(read_data(args.show_data[0]).head)
         except FileNotFoundError:
             print('File not found.')
             sys.exit(1)
 
     if args.count_classes:
-        count_data = pd.read_pickle(args.count_classes[0])
+        count_data = read_data(args.count_classes[0])
         print(count_data['label'].value_counts())
@@ -0,0 +1,371 @@
+import abc
+import argparse
+import hashlib
+import os
+import time
+
+import numpy as np
+import torch
+
+from small_text.query_strategies import QueryStrategy
+
+from chunked_io import read_data
+from inference_engine import tokenize, length_sorted_batches
+
+EMBEDDING_MODEL = "roberta-base"
+EMBEDDING_CACHE_DIR = ".cache/embeddings"
+
+
+def embed(model, tokenizer, sentences, batch_size=32, max_tokens=16384, max_length=500, verbose=False):
+    """
+    Computes L2-normalized sentence embeddings as the mean of the last hidden states over the tokens of a sentence.
+    :param model: PreTrainedModel
+        the encoder model
+    :param tokenizer: AutoTokenizer
+        containing the tokenizer of the model
+    :param sentences: List[str]
+        sentences to embed
+    :param batch_size: int
+        maximum number of sentences per forward pass
+    :param max_tokens: int
+        maximum number of (padded) tokens per forward pass
+    :param max_length: int
+        maximum sequence length to encode
+    :param verbose: Boolean
+        switch to print the progress on the console
+    :return: np.ndarray
+        float16 embeddings of shape (number of sentences, hidden size)
+    """
+    model.eval()
+    input_ids = tokenize(tokenizer, sentences, max_length=max_length)
+    embeddings = np.empty((len(input_ids), model.config.hidden_size), dtype=np.float16)
+    with torch.inference_mode():
+        for i, batch_indices in enumerate(length_sorted_batches([len(ids) for ids in input_ids], batch_size,
+                                                                max_tokens)):
+            if verbose:
+                print('embedding batch', i + 1)
+            batch = tokenizer.pad({'input_ids': [input_ids[j] for j in batch_indices]}, padding='longest',
+                                  return_tensors='pt')
+            mask = batch['attention_mask'].to(model.device)
+            hidden = model(batch['input_ids'].to(model.device), attention_mask=mask).last_hidden_state
+            mean = (hidden * mask[:, :, None]).sum(dim=1) / mask.sum(dim=1, keepdim=True)
+            embeddings[batch_indices] = torch.nn.functional.normalize(mean, dim=1).cpu().numpy()
+    return embeddings
+
+
+def load_embeddings(sentences, model_name=EMBEDDING_MODEL, cache_dir=EMBEDDING_CACHE_DIR, verbose=False):
+    """
+    Loads the embeddings of the given sentences as a memory-mapped float16 array. They are computed once and cached,
+    keyed by the model and the sentences, see active_learning.encode_pool().
+    :param sentences: List[str]
+        sentences to embed
+    :param model_name: str
+        path or name of the encoder model
+    :param cache_dir: str
+        directory of the cached embeddings
+    :param verbose: Boolean
+        switch to print the progress on the console
+    :return: np.ndarray
+        memory-mapped embeddings of shape (number of sentences, hidden size)
+    """
+    digest = hashlib.blake2b(model_name.encode("utf-8") + b"\0", digest_size=16)
+    for sentence in sentences:
+        digest.update(sentence.encode("utf-8") + b"\0")
+    name = os.path.basename(os.path.normpath(model_name))
+    path = os.path.join(cache_dir, f"{name}-{digest.hexdigest()}.npy")
+
+    if not os.path.exists(path):
+        from transformers import AutoModel, AutoTokenizer
+
+        print(f"embedding {len(sentences)} sentences with {model_name}...")
+        model = AutoModel.from_pretrained(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        embeddings = embed(model, tokenizer, list(sentences), verbose=verbose)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, embeddings)
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r')
+
+
+class EmbeddingIndex:
+    """
+    Exact nearest neighbour index over L2-normalized embeddings. Similarities are cosine similarities computed by
+    blockwise matrix products in float32, so that the float16 embeddings never have to be converted at once.
+    """
+
+    def __init__(self, embeddings, block_size=8192):
+        """
+        :param embeddings: np.ndarray
+            L2-normalized embeddings of shape (number of sentences, hidden size), e.g. from load_embeddings()
+        :param block_size: int
+            number of embeddings converted to float32 at a time
+        """
+        self.embeddings = embeddings
+        self.block_size = block_size
+        self.clusters = None
+        self.centroids = None
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def vectors(self, rows):
+        """
+        :param rows: np.ndarray[int]
+            rows of the index
+        :return: np.ndarray
+            float32 embeddings of the rows
+        """
+        return np.asarray(self.embeddings[rows], dtype=np.float32)
+
+    def similarities(self, queries, rows):
+        """
+        :param queries: np.ndarray
+            L2-normalized float32 vectors of shape (number of queries, hidden size)
+        :param rows: np.ndarray[int]
+            rows of the index to compare with
+        :return: Iterator[Tuple[np.ndarray, np.ndarray]]
+            rows of every block and their cosine similarities of shape (number of queries, rows of the block)
+        """
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            yield block, queries @ self.vectors(block).T
+
+    def search(self, queries, k=10, rows=None):
+        """
+        Finds the k most similar rows of every query vector.
+        :param queries: np.ndarray
+            L2-normalized vectors of shape (number of queries, hidden size)
+        :param k: int
+            number of neighbours
+        :param rows: np.ndarray[int]
+            rows of the index to search, None searches all rows
+        :return: np.ndarray[int]
+            rows of the neighbours of shape (number of queries, k), most similar first
+        :return: np.ndarray
+            cosine similarities of the neighbours
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(rows))
+        best_rows = np.empty((len(queries), 0), dtype=int)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for block, scores in self.similarities(queries, rows):
+            # keep the k best of the previous blocks and the current block
+            best_rows = np.concatenate([best_rows, np.broadcast_to(block, scores.shape)], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def k_center_greedy(self, candidates, centers, n):
+        """
+        Selects a diverse batch by the greedy k-center (core-set) algorithm: every step selects the candidate with the
+        largest cosine distance to its nearest center and adds it to the centers. Without centers (cold start) the
+        first selected candidate is the one nearest to the mean of all candidates.
+        :param candidates: np.ndarray[int]
+            rows to select from
+        :param centers: np.ndarray[int]
+            rows that are already covered, e.g. the labeled samples
+        :param n: int
+            number of rows to select
+        :return: np.ndarray[int]
+            the selected rows
+        """
+        candidates = np.asarray(candidates)
+        vectors = self.vectors(candidates)
+        # cosine distance to the nearest center of every candidate
+        min_distance = np.full(len(candidates), np.inf, dtype=np.float32)
+        for start in range(0, len(centers), self.block_size):
+            center_vectors = self.vectors(np.asarray(centers[start:start + self.block_size]))
+            min_distance = np.minimum(min_distance, 1 - (vectors @ center_vectors.T).max(axis=1))
+        first = int(np.argmax(min_distance if len(centers) else vectors @ vectors.mean(axis=0)))
+
+        selected = [first]
+        min_distance = np.minimum(min_distance, 1 - vectors @ vectors[first])
+        for _ in range(n - 1):
+            selected.append(int(np.argmax(min_distance)))
+            min_distance = np.minimum(min_distance, 1 - vectors @ vectors[selected[-1]])
+        return candidates[selected]
+
+    def cluster(self, n_clusters=50, seed=42):
+        """
+        Clusters all rows with k-means once, later calls reuse the clusters.
+        :param n_clusters: int
+            number of clusters
+        :param seed: int
+            random state of k-means
+        :return: np.ndarray[int]
+            cluster of every row
+        """
+        if self.clusters is None or len(self.centroids) != n_clusters:
+            from sklearn.cluster import MiniBatchKMeans
+
+            kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, n_init=3, batch_size=4096)
+            self.clusters = kmeans.fit(self.vectors(np.arange(len(self)))).labels_
+            self.centroids = kmeans.cluster_centers_.astype(np.float32)
+        return self.clusters
+
+    def cluster_coverage(self, candidates, covered, n, n_clusters=50, seed=42):
+        """
+        Selects one candidate from each of the n least covered clusters, i.e. the clusters with the fewest covered
+        rows relative to their size. The selected candidate of a cluster is the one nearest to its centroid.
+        :param candidates: np.ndarray[int]
+            rows to select from
+        :param covered: np.ndarray[int]
+            rows that are already covered, e.g. the labeled samples
+        :param n: int
+            number of rows to select
+        :param n_clusters: int
+            number of clusters, see cluster()
+        :param seed: int
+            random state of k-means
+        :return: np.ndarray[int]
+            the selected rows
+        """
+        candidates = np.asarray(candidates)
+        clusters = self.cluster(n_clusters, seed)
+        coverage = np.bincount(clusters[np.asarray(covered, dtype=int)], minlength=n_clusters)
+        candidate_clusters = clusters[candidates]
+        centrality = np.einsum('ij,ij->i', self.vectors(candidates), self.centroids[candidate_clusters])
+
+        selected = []
+        available = np.ones(len(candidates), dtype=bool)
+        cluster_sizes = np.maximum(np.bincount(clusters, minlength=n_clusters), 1)
+        counts = np.zeros(n_clusters)
+        while len(selected) < n:
+            # clusters without candidates left can't be selected
+            remaining = np.bincount(candidate_clusters[available], minlength=n_clusters) > 0
+            cluster = int(np.argmin(np.where(remaining, (coverage + counts) / cluster_sizes, np.inf)))
+            members = np.flatnonzero(available & (candidate_clusters == cluster))
+            choice = members[np.argmax(centrality[members])]
+            selected.append(choice)
+            available[choice] = False
+            counts[cluster] += 1
+        return candidates[selected]
+
+
+class IndexQueryStrategy(QueryStrategy):
+    """
+    Base class of query strategies on a precomputed EmbeddingIndex whose rows are the indices of the dataset. They
+    don't need the classifier, so they can also be used for cold-start queries.
+    """
+
+    def __init__(self, index=None):
+        """
+        :param index: EmbeddingIndex
+            index of the dataset, can also be set later
+        """
+        self.index = index
+
+    def query(self, clf, dataset, indices_unlabeled, indices_labeled, y, n=10):
+        self._validate_query_input(indices_unlabeled, n)
+        if self.index is None or len(self.index) != len(dataset):
+            raise ValueError('the embedding index has to cover every sample of the dataset')
+        return self.select(np.asarray(indices_unlabeled), np.asarray(indices_labeled), n)
+
+    @abc.abstractmethod
+    def select(self, indices_unlabeled, indices_labeled, n):
+        """
+        :param indices_unlabeled: np.ndarray[int]
+            indices of the unlabeled samples
+        :param indices_labeled: np.ndarray[int]
+            indices of the labeled samples
+        :param n: int
+            number of samples to select
+        :return: np.ndarray[int]
+            indices of the selected samples
+        """
+        pass
+
+
+class IndexedCoreset(IndexQueryStrategy):
+    """Selects a diverse batch by the greedy k-center algorithm, see EmbeddingIndex.k_center_greedy()."""
+
+    def select(self, indices_unlabeled, indices_labeled, n):
+        return self.index.k_center_greedy(indices_unlabeled, indices_labeled, n)
+
+    def __str__(self):
+        return 'IndexedCoreset()'
+
+
+class ClusterCoverage(IndexQueryStrategy):
+    """Selects representatives of the least labeled clusters, see EmbeddingIndex.cluster_coverage()."""
+
+    def __init__(self, index=None, n_clusters=50, seed=42):
+        """
+        :param index: EmbeddingIndex
+            index of the dataset, can also be set later
+        :param n_clusters: int
+            number of clusters
+        :param seed: int
+            random state of k-means
+        """
+        super().__init__(index)
+        self.n_clusters = n_clusters
+        self.seed = seed
+
+    def select(self, indices_unlabeled, indices_labeled, n):
+        return self.index.cluster_coverage(indices_unlabeled, indices_labeled, n, self.n_clusters, self.seed)
+
+    def __str__(self):
+        return f'ClusterCoverage(n_clusters={self.n_clusters})'
+
+
+def similar_sentences(sentence, sentences, index, k=10, rows=None, model_name=EMBEDDING_MODEL):
+    """
+    Finds the sentences of an index that are most similar to a given sentence.
+    :param sentence: str
+        the sentence to look up
+    :param sentences: List[str]
+        sentences of the index
+    :param index: EmbeddingIndex
+        index of the sentences
+    :param k: int
+        number of similar sentences
+    :param rows: np.ndarray[int]
+        rows of the index to search, e.g. the unlabeled samples, None searches all rows
+    :param model_name: str
+        path or name of the encoder model the index was built with
+    :return: List[Tuple[int, float, str]]
+        row, cosine similarity and text of the similar sentences, most similar first
+    """
+    from transformers import AutoModel, AutoTokenizer
+
+    query = embed(AutoModel.from_pretrained(model_name), AutoTokenizer.from_pretrained(model_name), [sentence])
+    neighbours, scores = index.search(query, k, rows)
+    return [(int(row), float(score), sentences[row]) for row, score in zip(neighbours[0], scores[0])]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the sentence embedding index of a dataset and query it.")
+    parser.add_argument('--import_data', nargs="?", default="data/candidates_unlabeled.pkl", action='store',
+                        help='Dataset with column "candidate" to index.')
+    parser.add_argument('--model', default=EMBEDDING_MODEL, help='Path or name of the encoder model.')
+    parser.add_argument('--similar', action='store', help='Print the sentences most similar to a given sentence.')
+    parser.add_argument('-k', type=int, default=10, help='Number of similar sentences or of selected samples.')
+    parser.add_argument('--select', choices=['coreset', 'clusters'],
+                        help='Print a diverse cold-start batch of k sentences selected by the given strategy.')
+    parser.add_argument('--n_clusters', type=int, default=50, help='Number of clusters of --select clusters.')
+    args = parser.parse_args()
+
+    sentences = read_data(args.import_data)["candidate"].values.tolist()
+    embedding_index = EmbeddingIndex(load_embeddings(sentences, args.model, verbose=True))
+    print(f"{len(embedding_index)} sentences indexed")
+    if args.similar:
+        for row, score, text in similar_sentences(args.similar, sentences, embedding_index, args.k,
+                                                  model_name=args.model):
+            print(f"{score:.3f} {row} {text}")
+    if args.select:
+        start = time.perf_counter()
+        if args.select == 'coreset':
+            selected = embedding_index.k_center_greedy(np.arange(len(sentences)), [], args.k)
+        else:
+            selected = embedding_index.cluster_coverage(np.arange(len(sentences)), [], args.k, args.n_clusters)
+        print(f"selected in {time.perf_counter() - start:.2f}s")
+        for row in selected:
+            print(row, sentences[row])
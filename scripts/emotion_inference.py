@@ -1,74 +1,159 @@
 import argparse
-from tabnanny import verbose
+import functools
+import time
 
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import pandas as pd
-import torch
-import torch.nn.functional as F
+# torch, transformers and pandas are imported where they are needed, so that e.g. --help stays fast
 
+# start of the script, for the startup time and the time to the first classified chunk
+START_TIME = time.perf_counter()
+MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
+TARGET_NAMES = ["anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"]
 
-def perform_emotion_analysis(model_name, ds_path, save_data, target_names, verbose=False):
+
+def load_model(model_name):
+    """
+    :param model_name: str
+        model name on the HuggingFace hub
+    :return: PreTrainedModel
+        the emotion classification model
+    :return: AutoTokenizer
+        containing the tokenizer of the model
+    """
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    return AutoModelForSequenceClassification.from_pretrained(model_name), AutoTokenizer.from_pretrained(model_name)
+
+
+def perform_emotion_analysis(model_name, ds_path, save_data, target_names, verbose=False, batch_size=32,
+                             max_tokens=16384, cache_path=None, chunk_size=10000, resume=False, workers=1,
+                             threads=None, backend="torch"):
     """
-    Performs emotion analysis and saves the newly labeled data in ds_path
+    Performs emotion analysis chunk by chunk and appends every newly labeled chunk to save_data
     :param model_name: str
         model name on the HuggingFace hub
     :param ds_path: str
-        file path of the pd.DataFrame 
+        file path of the dataset (.pkl or .parquet)
     :param save_data: str
-        file path of to save the pd.DataFrame 
+        file path to save the dataset (.pkl or .parquet directory)
     :param target_names: List[str]
         list of the specific model's class names
     :param verbose: Boolean
         switch to print additional information on the console
+    :param batch_size: int
+        maximum number of sentences per forward pass
+    :param max_tokens: int
+        maximum number of (padded) tokens per forward pass
+    :param cache_path: str
+        path to a cache database with predictions of earlier runs, None disables caching
+    :param chunk_size: int
+        number of rows read, classified and written at once
+    :param resume: Boolean
+        skip the chunks already written to save_data by an interrupted run
+    :param workers: int
+        number of worker processes with their own model replica, 1 classifies in this process
+    :param threads: int
+        number of torch threads per process
+    :param backend: str
+        inference backend, one of BACKENDS
     """
+    from chunked_io import ChunkedWriter, iter_ranges
+    from inference_backends import backend_model_id, load_backend
+    from inference_cache import InferenceCache, cached_predict_proba
+    from inference_engine import Predictor
+
+    load_fn = functools.partial(load_backend, functools.partial(load_model, model_name), model_name, backend)
+    predictor = Predictor(load_fn, workers, threads, batch_size, max_tokens, max_length=None, verbose=verbose)
 
-    # batch the data because classifying everything at once takes too long
-    inference_batch_size = 4
-    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-
-    input_data = pd.read_pickle(ds_path)
-    # we only want to label future statements
-    input_data = input_data.loc[input_data["future_statement"] == 0].reset_index(drop=True)
-    batched_targets = []
-    for i in range(input_data.shape[0] // inference_batch_size + 1):
-        # break if we already at the end of the data
-        if i * inference_batch_size == input_data.shape[0]:
-            break
-        if verbose:
-            print("inference on batch", i + 1)
-
-        input_data_str = input_data["candidate"].values.tolist()[
-                         i * inference_batch_size:min(i * inference_batch_size + inference_batch_size,
-                                                      input_data.shape[0])]
-        encoded_inputs = tokenizer(input_data_str, padding=True, truncation="longest_first", return_tensors="pt")
-        targets = model(**encoded_inputs)
-        # target contains logits, softmax to get probabilty distribution over all classes
-        batched_targets.append(F.softmax(targets[0].detach(), dim=1))
-
-    # concatinate the batches and add the labels to the DataFrame
-    targets = torch.cat(batched_targets, dim=0).numpy()
-    for i, target_name in enumerate(target_names):
-        input_data[target_name] = targets[:, i]
-    if verbose:
-        print(input_data)
-    input_data.to_pickle(save_data)
+    # probabilty distribution over all classes
+    cache = InferenceCache(cache_path, backend_model_id(model_name, backend)) if cache_path else None
+    # the time until the model can predict, without the inference of the first chunk
+    print(f"startup time: {time.perf_counter() - START_TIME:.1f}s")
+    first_prediction = True
+    with ChunkedWriter(save_data, resume, {"input": ds_path, "chunk_size": chunk_size}) as writer:
+        for start, end, input_data in iter_ranges(ds_path, chunk_size, skip=writer.completed):
+            # we only want to label future statements
+            input_data = input_data.loc[input_data["future_statement"] == 0].reset_index(drop=True)
+            if input_data.empty:
+                writer.write(input_data, rows=(start, end))
+                continue
+            targets = cached_predict_proba(cache, input_data["candidate"].values.tolist(), predictor.predict,
+                                           predictor.num_labels, verbose)
+            if first_prediction:
+                print(f"time to first classified chunk: {time.perf_counter() - START_TIME:.1f}s")
+                first_prediction = False
+
+            # add the labels to the DataFrame
+            for i, target_name in enumerate(target_names):
+                input_data[target_name] = targets[:, i]
+            if verbose:
+                print(input_data)
+            writer.write(input_data, rows=(start, end))
+    predictor.close()
+    if cache is not None:
+        print(f"cache hit rate: {cache.hit_rate():.1%}")
+        cache.close()
 
 
 if __name__ == "__main__":
     args_parser = argparse.ArgumentParser()
-    args_parser.add_argument('--import_data', nargs="?", default="data/future_classification.pkl", action='store',
+    args_parser.add_argument('--import_data', nargs="?", default="data/future_classification.parquet", action='store',
                              help='Import data from a given path. Tries to use an existing dataset if not provided.')
-    args_parser.add_argument('--save_data', nargs="?", default="data/emotion_classification.pkl", action='store',
-                             help='save data to a given path. Tries to use an existing name if not provided.')
+    args_parser.add_argument('--save_data', nargs="?", default="data/emotion_classification.parquet", action='store',
+                             help='save data to a given path (.parquet directory or .pkl). Tries to use an existing '
+                                  'name if not provided.')
     args_parser.add_argument("-v", "--verbose", action="store_true",
                              help="Print additional information on the console.")
+    args_parser.add_argument('--batch_size', '--batch-size', type=int, default=32,
+                             help='Maximum number of sentences per forward pass.')
+    args_parser.add_argument('--max_tokens', type=int, default=16384,
+                             help='Maximum number of (padded) tokens per forward pass.')
+    args_parser.add_argument('--cache', nargs="?", const="data/inference_cache.sqlite", action='store',
+                             help='Reuse predictions of earlier runs stored in a given cache database.')
+    args_parser.add_argument('--chunk_size', type=int, default=10000,
+                             help='Number of rows read, classified and written at once.')
+    args_parser.add_argument('--resume', action='store_true',
+                             help='Continue an interrupted run and skip the chunks it already wrote to --save_data.')
+    args_parser.add_argument('--workers', type=int, default=1,
+                             help='Number of worker processes, each with its own model replica.')
+    args_parser.add_argument('--threads', type=int,
+                             help='Number of torch threads per process. Defaults to the number of cores divided by the '
+                                  'number of workers.')
+    args_parser.add_argument('--benchmark', nargs="?", type=int, const=2000, action='store',
+                             help='Measure the throughput of 1, 2, 4 and 8 workers with 1, 2, 4 and 8 threads each on '
+                                  'the first N sentences of --import_data instead of classifying it.')
+    # choices are BACKENDS of inference_backends.py, which imports torch
+    args_parser.add_argument('--backend', choices=["torch", "int8", "onnx", "onnx-int8"], default="torch",
+                             help='Inference backend: fp32 torch, dynamic int8 quantized torch or an ONNX Runtime graph (fp32 or '
+                                  'int8). Converted models are cached in models/backends.')
+    args_parser.add_argument('--parity_check', nargs="?", const="data/candidates_labeled.pkl", action='store',
+                             help='Compare the predictions and the throughput of --backend with the fp32 model on a given '
+                                  'dataset instead of classifying --import_data.')
     args = args_parser.parse_args()
 
-    model_name = "j-hartmann/emotion-english-distilroberta-base"
+    model_name = MODEL_NAME
     ds_path = args.import_data
     save_data = args.save_data
-    target_names = ["anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"]
+    target_names = TARGET_NAMES
     verbose = args.verbose
 
-    perform_emotion_analysis(model_name, ds_path, save_data, target_names, verbose)
+    if args.parity_check:
+        from chunked_io import read_data
+        from inference_backends import parity_check
+
+        # the labels of the dataset are future statement labels, only the agreement with fp32 is measured
+        sentences = read_data(args.parity_check)["candidate"].values.tolist()
+        parity_check(functools.partial(load_model, model_name), model_name, args.backend, sentences,
+                     batch_size=args.batch_size, max_tokens=args.max_tokens, max_length=None)
+    elif args.benchmark:
+        from chunked_io import iter_batches
+        from inference_backends import load_backend
+        from inference_engine import benchmark_layouts
+
+        load_fn = functools.partial(load_backend, functools.partial(load_model, model_name), model_name, args.backend)
+        sentences = next(iter_batches(ds_path, args.benchmark))["candidate"].values.tolist()
+        benchmark_layouts(load_fn, sentences, batch_size=args.batch_size, max_tokens=args.max_tokens,
+                          max_length=None)
+    else:
+        perform_emotion_analysis(model_name, ds_path, save_data, target_names, verbose, args.batch_size,
+                                 args.max_tokens, args.cache, args.chunk_size, args.resume, args.workers, args.threads,
+                                 args.backend)
@@ -0,0 +1,146 @@
+import argparse
+import queue
+import resource
+import threading
+import time
+
+from chunked_io import ChunkedWriter, iter_ranges
+from emotion_inference import MODEL_NAME, TARGET_NAMES
+from emotion_inference import load_model as load_emotion_model
+from future_inference import FUTURE_STATEMENT, default_model_path
+from future_inference import load_model as load_future_model
+from inference_engine import tokenize, predict_proba
+
+
+def classify_stream(future_model, future_tokenizer, emotion_model, emotion_tokenizer, chunks, emotion_writer,
+                    future_writer=None, queue_size=4, batch_size=32, max_tokens=16384, verbose=False):
+    """
+    Streams chunks of sentences through the future statement classifier and passes only the statements about the
+    future on to the emotion model. Both stages run concurrently, connected by a bounded queue.
+    :param future_model: PreTrainedModel
+        the future statement classification model
+    :param future_tokenizer: AutoTokenizer
+        containing the tokenizer of the future statement model
+    :param emotion_model: PreTrainedModel
+        the emotion classification model
+    :param emotion_tokenizer: AutoTokenizer
+        containing the tokenizer of the emotion model
+    :param chunks: Iterable[Tuple[int, int, DataFrame]]
+        first row, last row + 1 and rows of every chunk of the dataset with column "candidate"
+    :param emotion_writer: ChunkedWriter
+        writer for the statements about the future with their emotion probabilities
+    :param future_writer: ChunkedWriter
+        optional writer for all sentences with their future statement label
+    :param queue_size: int
+        maximum number of chunks waiting for the emotion model
+    :param batch_size: int
+        maximum number of sentences per forward pass
+    :param max_tokens: int
+        maximum number of (padded) tokens per forward pass
+    :param verbose: Boolean
+        switch to print the progress on the console
+    :return: dict
+        number of classified sentences and statements about the future, busy time in seconds of both stages
+    """
+    positives_queue = queue.Queue(maxsize=queue_size)
+    stats = {"sentences": 0, "future_statements": 0, "future_busy": 0.0, "emotion_busy": 0.0}
+    errors = []
+
+    def emotion_stage():
+        while True:
+            item = positives_queue.get()
+            if item is None:
+                break
+            rows, future_statements = item
+            if errors:
+                continue  # keep draining, so that the future stage never blocks on a full queue
+            try:
+                start = time.perf_counter()
+                if not future_statements.empty:
+                    encoded = tokenize(emotion_tokenizer, future_statements["candidate"].values.tolist(),
+                                       max_length=emotion_tokenizer.model_max_length)
+                    probabilities = predict_proba(emotion_model, emotion_tokenizer, encoded, batch_size, max_tokens)
+                    for i, target_name in enumerate(TARGET_NAMES):
+                        future_statements[target_name] = probabilities[:, i]
+                # the range is recorded even without statements about the future, so that a resumed run skips it
+                emotion_writer.write(future_statements, rows=rows)
+                stats["future_statements"] += len(future_statements)
+                stats["emotion_busy"] += time.perf_counter() - start
+            except Exception as e:
+                errors.append(e)
+
+    consumer = threading.Thread(target=emotion_stage, daemon=True)
+    consumer.start()
+    try:
+        for chunk_start, chunk_end, chunk in chunks:
+            if errors:
+                break
+            start = time.perf_counter()
+            labels = predict_proba(future_model, future_tokenizer,
+                                   tokenize(future_tokenizer, chunk["candidate"].values.tolist()), batch_size,
+                                   max_tokens).argmax(axis=1)
+            chunk = chunk.assign(future_statement=labels)
+            # after an interruption the future labels of a chunk may already be written while its emotions are not
+            if future_writer is not None and not future_writer.completed(chunk_start, chunk_end):
+                future_writer.write(chunk, rows=(chunk_start, chunk_end))
+            stats["sentences"] += len(chunk)
+            stats["future_busy"] += time.perf_counter() - start
+            future_statements = chunk.loc[labels == FUTURE_STATEMENT].reset_index(drop=True)
+            positives_queue.put(((chunk_start, chunk_end), future_statements))
+            if verbose:
+                print(f"classified {stats['sentences']} sentences, "
+                      f"{positives_queue.qsize()} chunks waiting for the emotion model")
+    finally:
+        positives_queue.put(None)
+        consumer.join()
+    if errors:
+        raise errors[0]
+    return stats
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser(description="Classify statements about the future and their emotions in one "
+                                                      "pass.")
+    args_parser.add_argument('--import_data', nargs="?", default="data/classification_set.pkl", action='store',
+                             help='Import data from a given path. Tries to use an existing dataset if not provided.')
+    args_parser.add_argument('--save_data', nargs="?", default="data/emotion_classification.parquet", action='store',
+                             help='save the statements about the future with their emotions to a given path.')
+    args_parser.add_argument('--save_future', nargs="?", action='store',
+                             help='Additionally save all sentences with their future statement label to a given path.')
+    args_parser.add_argument("-v", "--verbose", action="store_true",
+                             help="Print additional information on the console.")
+    args_parser.add_argument('--chunk_size', type=int, default=1024,
+                             help='Number of rows read and classified before their positives are passed on.')
+    args_parser.add_argument('--queue_size', type=int, default=4,
+                             help='Maximum number of chunks waiting for the emotion model.')
+    args_parser.add_argument('--batch_size', '--batch-size', type=int, default=32,
+                             help='Maximum number of sentences per forward pass.')
+    args_parser.add_argument('--max_tokens', type=int, default=16384,
+                             help='Maximum number of (padded) tokens per forward pass.')
+    args_parser.add_argument('--resume', action='store_true',
+                             help='Continue an interrupted run and skip the chunks it already wrote.')
+    args = args_parser.parse_args()
+
+    start_time = time.perf_counter()
+    future_model, future_tokenizer = load_future_model(default_model_path())
+    emotion_model, emotion_tokenizer = load_emotion_model(MODEL_NAME)
+
+    settings = {"input": args.import_data, "chunk_size": args.chunk_size}
+    future_writer = ChunkedWriter(args.save_future, args.resume, settings) if args.save_future else None
+    with ChunkedWriter(args.save_data, args.resume, settings) as emotion_writer:
+        def completed(start, end):
+            return emotion_writer.completed(start, end) and \
+                (future_writer is None or future_writer.completed(start, end))
+
+        stats = classify_stream(future_model, future_tokenizer, emotion_model, emotion_tokenizer,
+                                iter_ranges(args.import_data, args.chunk_size, skip=completed), emotion_writer,
+                                future_writer, args.queue_size, args.batch_size, args.max_tokens, args.verbose)
+    if future_writer is not None:
+        future_writer.close()
+
+    wall_time = time.perf_counter() - start_time
+    # ru_maxrss is given in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{stats['sentences']} sentences, {stats['future_statements']} statements about the future")
+    print(f"wall time: {wall_time:.1f}s (future stage busy {stats['future_busy']:.1f}s, "
+          f"emotion stage busy {stats['emotion_busy']:.1f}s), peak RSS: {peak_rss:.0f} MB")
@@ -1,37 +1,141 @@
 import argparse
-from tabnanny import verbose
+import functools
+import os
+import time
 
-from small_text.integrations.transformers.datasets import TransformersDataset
-from small_text.active_learner import PoolBasedActiveLearner
-from transformers import AutoTokenizer
-import pandas as pd
+# torch, transformers, small_text and pandas are imported where they are needed, so that e.g. --help stays fast
 
+# start of the script, for the startup time and the time to the first classified chunk
+START_TIME = time.perf_counter()
+MODEL_PATH = "models/20220824_76futacc.pkl"
+# classifier-only export of MODEL_PATH, see export_classifier()
+CLASSIFIER_PATH = "models/future_classifier"
+TOKENIZER_NAME = "roberta-base"
+# class index of statements about the future, see LABELS in active_learning.py
+FUTURE_STATEMENT = 0
 
-def preprocess_data(tokenizer, data, max_length=500):
+
+def default_model_path():
+    """
+    :return: str
+        the classifier-only export if it exists, otherwise the active learning checkpoint
+    """
+    return CLASSIFIER_PATH if os.path.isdir(CLASSIFIER_PATH) else MODEL_PATH
+
+
+def load_model(model_path):
     """
-    Converts a list of string sentence into an TransformersDataset as model input
-    :param tokenizer: AutoTokenizer
+    Loads the future statement classifier, either from a classifier-only export or from a saved
+    PoolBasedActiveLearner. Only the export avoids unpickling the complete active learner.
+    :param model_path: str
+        directory of a classifier-only export or file path of a saved PoolBasedActiveLearner
+    :return: PreTrainedModel
+        the future statement classification model
+    :return: AutoTokenizer
         containing the tokenizer of the model
-    :param data: List[str]
-        the text data
-    :param max_len: int
-        Maximum sequence length to encode 
-    :return TransformerDataset
-        the dataset to input into the model
-    """
-    data_out = []
-    for i, doc in enumerate(data):
-        encoded_dict = tokenizer.encode_plus(
-            doc,
-            add_special_tokens=True,
-            padding='max_length',
-            max_length=max_length,
-            return_attention_mask=True,
-            return_tensors='pt',
-            truncation='longest_first'
-        )
-        data_out.append((encoded_dict['input_ids'], encoded_dict['attention_mask'], 0))  # Dummy label, ingore!
-    return TransformersDataset(data_out)
+    """
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    if os.path.isdir(model_path):
+        return AutoModelForSequenceClassification.from_pretrained(model_path), AutoTokenizer.from_pretrained(model_path)
+
+    from small_text.active_learner import PoolBasedActiveLearner
+
+    return PoolBasedActiveLearner.load(model_path).classifier.model, AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+
+
+def export_classifier(model_path, export_path):
+    """
+    Saves the classifier of an active learning checkpoint with its tokenizer in the HuggingFace format.
+    :param model_path: str
+        file path of the saved PoolBasedActiveLearner
+    :param export_path: str
+        directory of the export
+    """
+    model, tokenizer = load_model(model_path)
+    model.save_pretrained(export_path)
+    tokenizer.save_pretrained(export_path)
+
+
+def perform_future_classification(model_path, ds_path, save_data, verbose=False, batch_size=32, max_tokens=16384,
+                                  cache_path=None, chunk_size=10000, resume=False, workers=1, threads=None,
+                                  backend="torch", cascade_path=None, cascade_threshold=None):
+    """
+    Classifies statements about the future chunk by chunk and appends every classified chunk to save_data
+    :param model_path: str
+        directory of a classifier-only export or file path of a saved PoolBasedActiveLearner
+    :param ds_path: str
+        file path of the dataset (.pkl or .parquet)
+    :param save_data: str
+        file path to save the dataset (.pkl or .parquet directory)
+    :param verbose: Boolean
+        switch to print additional information on the console
+    :param batch_size: int
+        maximum number of sentences per forward pass
+    :param max_tokens: int
+        maximum number of (padded) tokens per forward pass
+    :param cache_path: str
+        path to a cache database with predictions of earlier runs, None disables caching
+    :param chunk_size: int
+        number of rows read, classified and written at once
+    :param resume: Boolean
+        skip the chunks already written to save_data by an interrupted run
+    :param workers: int
+        number of worker processes with their own model replica, 1 classifies in this process
+    :param threads: int
+        number of torch threads per process
+    :param backend: str
+        inference backend, one of BACKENDS
+    :param cascade_path: str
+        path to a trained cascade (see cascade.py), only sentences the cascade is unsure about are passed to the
+        model, None passes all sentences to the model
+    :param cascade_threshold: float
+        minimum first-stage probability accepted by the cascade, None uses the threshold chosen in training
+    """
+    from chunked_io import ChunkedWriter, iter_ranges
+    from inference_backends import backend_model_id, load_backend
+    from inference_cache import InferenceCache, cached_predict_proba
+    from inference_engine import Predictor
+
+    load_fn = functools.partial(load_backend, functools.partial(load_model, model_path), model_path, backend)
+    predictor = Predictor(load_fn, workers, threads, batch_size, max_tokens)
+    cache = InferenceCache(cache_path, backend_model_id(model_path, backend)) if cache_path else None
+    cascade = None
+    if cascade_path:
+        from cascade import Cascade, cascade_predict_proba
+
+        cascade = Cascade.load(cascade_path)
+        if cascade_threshold is not None:
+            cascade.threshold = cascade_threshold
+    # the time until the model can predict, without the inference of the first chunk
+    print(f"startup time: {time.perf_counter() - START_TIME:.1f}s")
+    n_sentences = n_escalated = 0
+    first_prediction = True
+    with ChunkedWriter(save_data, resume, {"input": ds_path, "chunk_size": chunk_size}) as writer:
+        for start, end, input_data in iter_ranges(ds_path, chunk_size, skip=writer.completed):
+            sentences = input_data["candidate"].values.tolist()
+            predict_fn = functools.partial(cached_predict_proba, cache, predict_fn=predictor.predict,
+                                           num_labels=predictor.num_labels, verbose=verbose)
+            if cascade is None:
+                probabilities = predict_fn(sentences)
+            else:
+                probabilities, escalated = cascade_predict_proba(cascade, sentences, predict_fn)
+                n_sentences += len(sentences)
+                n_escalated += escalated
+            if first_prediction:
+                print(f"time to first classified chunk: {time.perf_counter() - START_TIME:.1f}s")
+                first_prediction = False
+            input_data = input_data.assign(future_statement=probabilities.argmax(axis=1))
+            if verbose:
+                print("label_result")
+                print(input_data)
+            writer.write(input_data, rows=(start, end))
+    predictor.close()
+    if cascade is not None:
+        print(f"escalated to the model: {n_escalated}/{n_sentences} sentences")
+    if cache is not None:
+        print(f"cache hit rate: {cache.hit_rate():.1%}")
+        cache.close()
 
 
 if __name__ == "__main__":
@@ -40,24 +144,71 @@ if __name__ == "__main__":
                             help='Import data from a given path. Tries to use an existing dataset if not provided.')
     args_parser.add_argument("-v", "--verbose", action="store_true", 
                             help="Print additional information on the console.")
-    args_parser.add_argument('--save_data', nargs="?", default="data/future_classification.pkl", action='store',
-                            help='save data to a given path. Tries to use an existing name if not provided.')
+    args_parser.add_argument('--save_data', nargs="?", default="data/future_classification.parquet", action='store',
+                            help='save data to a given path (.parquet directory or .pkl). Tries to use an existing name '
+                                 'if not provided.')
+    args_parser.add_argument('--batch_size', '--batch-size', type=int, default=32,
+                            help='Maximum number of sentences per forward pass.')
+    args_parser.add_argument('--max_tokens', type=int, default=16384,
+                            help='Maximum number of (padded) tokens per forward pass.')
+    args_parser.add_argument('--cache', nargs="?", const="data/inference_cache.sqlite", action='store',
+                            help='Reuse predictions of earlier runs stored in a given cache database.')
+    args_parser.add_argument('--chunk_size', type=int, default=10000,
+                            help='Number of rows read, classified and written at once.')
+    args_parser.add_argument('--resume', action='store_true',
+                            help='Continue an interrupted run and skip the chunks it already wrote to --save_data.')
+    args_parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes, each with its own model replica.')
+    args_parser.add_argument('--threads', type=int,
+                            help='Number of torch threads per process. Defaults to the number of cores divided by the '
+                                 'number of workers.')
+    args_parser.add_argument('--benchmark', nargs="?", type=int, const=2000, action='store',
+                            help='Measure the throughput of 1, 2, 4 and 8 workers with 1, 2, 4 and 8 threads each on '
+                                 'the first N sentences of --import_data instead of classifying it.')
+    # choices are BACKENDS of inference_backends.py, which imports torch
+    args_parser.add_argument('--backend', choices=["torch", "int8", "onnx", "onnx-int8"], default="torch",
+                            help='Inference backend: fp32 torch, dynamic int8 quantized torch or an ONNX Runtime graph (fp32 or '
+                                 'int8). Converted models are cached in models/backends.')
+    args_parser.add_argument('--parity_check', nargs="?", const="data/candidates_labeled.pkl", action='store',
+                            help='Compare the predictions and the throughput of --backend with the fp32 model on a given '
+                                 'dataset instead of classifying --import_data.')
+    args_parser.add_argument('--model', nargs="?", action='store',
+                            help='Classifier-only export or active learning checkpoint to use. Defaults to '
+                                 f'{CLASSIFIER_PATH} if it exists, otherwise {MODEL_PATH}.')
+    args_parser.add_argument('--export_classifier', nargs="?", const=CLASSIFIER_PATH, action='store',
+                            help='Export the classifier of the active learning checkpoint given by --model (default: '
+                                 f'{MODEL_PATH}) to a given directory, which loads much faster than the checkpoint.')
+    args_parser.add_argument('--cascade', nargs="?", const="models/future_cascade.pkl", action='store',
+                             help='Accept confident decisions of a cheap first stage trained with cascade.py and only '
+                                  'pass the remaining sentences to the model.')
+    args_parser.add_argument('--cascade_threshold', type=float,
+                             help='Minimum first-stage probability accepted by --cascade (default: the threshold chosen '
+                                  'in training).')
     args = args_parser.parse_args()
 
-    model = PoolBasedActiveLearner.load("models/20220824_76futacc.pkl").classifier
-    ds_path = args.import_data
-
-    tokenizer = AutoTokenizer.from_pretrained("roberta-base")
+    if args.export_classifier:
+        export_classifier(args.model or MODEL_PATH, args.export_classifier)
+        print(f"classifier exported to {args.export_classifier}")
+    elif args.parity_check:
+        from chunked_io import read_data
+        from inference_backends import parity_check
 
-    input_data = pd.read_pickle(ds_path)
-    if args.verbose:
-        print(input_data)
-    input_data_str = input_data["candidate"].values
-    encoded_inputs = preprocess_data(tokenizer, input_data_str)
+        model_path = args.model or default_model_path()
+        labeled = read_data(args.parity_check)
+        parity_check(functools.partial(load_model, model_path), model_path, args.backend,
+                     labeled["candidate"].values.tolist(), labeled["label"].values.astype(int), args.batch_size,
+                     args.max_tokens)
+    elif args.benchmark:
+        from chunked_io import iter_batches
+        from inference_backends import load_backend
+        from inference_engine import benchmark_layouts
 
-    targets = model.predict(encoded_inputs)
-    input_data["future_statement"] = targets
-    if args.verbose:
-        print("label_result")
-        print(input_data)
-    input_data.to_pickle(args.save_data)
+        model_path = args.model or default_model_path()
+        load_fn = functools.partial(load_backend, functools.partial(load_model, model_path), model_path, args.backend)
+        sentences = next(iter_batches(args.import_data, args.benchmark))["candidate"].values.tolist()
+        benchmark_layouts(load_fn, sentences, batch_size=args.batch_size, max_tokens=args.max_tokens)
+    else:
+        perform_future_classification(args.model or default_model_path(), args.import_data, args.save_data,
+                                      args.verbose, args.batch_size, args.max_tokens, args.cache, args.chunk_size,
+                                      args.resume, args.workers, args.threads, args.backend, args.cascade,
+                                      args.cascade_threshold)
@@ -1,78 +1,207 @@
 import collections
+import copy
 import json
 import re
+import sys
 import threading
 import time
 import base64
+import argparse
 import resiliparse.parse.lang
 import numpy as np
 
+from candidate_shards import ShardWriter
 from pipelines.text_pipeline import TextPipeline
 from pipelines.tools.passthrough_model import PassthroughModelPipeline
 
+URL_PATTERN = re.compile(r"\((?P<url>https?://\S+)\)")
+SENTENCE_PATTERN = re.compile(r".*?[.!?]")
+# the keyword gate only scans this many payload bytes, longer records without a trigger word in them are accepted
+KEYWORD_GATE_BYTES = 1 << 20
+KEYWORD_GATE_CHUNK = 1 << 16
+
+
+def extract_matching_sentences(text, regex):
+    """
+    Splits a website text into sentences and returns all sentences that contain a regex match.
+    Cleans the text from urls first to avoid interferences with the sentence regex, caused by punctuations in urls.
+    The regex runs only once over the text. Its match offsets are mapped onto the sentence boundaries with a single
+    merge over both (ordered) lists, so that no sentence gets rescanned for match strings.
+    :param text: str
+        text of a website
+    :param regex: re.Pattern
+        precompiled regex to search for
+    :return: list
+        all sentences (str) that fully contain at least one match, in order of appearance
+    :return: int
+        number of regex matches in the text
+    """
+    text = URL_PATTERN.sub("", text)
+    match_spans = [match.span() for match in regex.finditer(text)]
+    if not match_spans:
+        return [], 0
+
+    sentences = []
+    i = 0
+    for sentence in SENTENCE_PATTERN.finditer(text):
+        start, end = sentence.span()
+        # matches are ordered and don't overlap, so their end offsets are ordered as well
+        while i < len(match_spans) and match_spans[i][0] < start:
+            i += 1
+        if i == len(match_spans):
+            break
+        if match_spans[i][1] <= end:
+            sentences.append(sentence.group())
+    return sentences, len(match_spans)
+
+
+def contains_trigger_word(reader, trigger_words, max_bytes=KEYWORD_GATE_BYTES, chunk_size=KEYWORD_GATE_CHUNK):
+    """
+    Scans a payload chunk by chunk for lowercase trigger words and stops at the first one.
+    :param reader: BufferedReader
+        reader of the payload, it gets consumed
+    :param trigger_words: list
+        lowercase byte strings to search for
+    :param max_bytes: int
+        number of bytes scanned at most
+    :param chunk_size: int
+        number of bytes lowercased at once
+    :return: Boolean
+        True if the payload contains a trigger word or is longer than max_bytes
+    """
+    # words that cross a chunk border are found in the kept tail of the previous chunk
+    overlap = max(len(word) for word in trigger_words) - 1
+    tail = b""
+    n_read = 0
+    while n_read < max_bytes:
+        chunk = reader.read(min(chunk_size, max_bytes - n_read))
+        if not chunk:
+            return False
+        n_read += len(chunk)
+        window = tail + chunk.lower()
+        if any(word in window for word in trigger_words):
+            return True
+        tail = window[len(window) - overlap:]
+    return len(reader.read(1)) > 0
+
 
 class FutureRegexFinderPipeline(PassthroughModelPipeline, TextPipeline):
     """
     This pipeline allows to search for regex occurrences within the texts from the text pipeline.
-    The texts which are passed to the export method will be split into sentences and saved when matched with a regex.
+    The texts are filtered and split into sentences by the generator already, only the sentences matched with a regex
+    are passed on to the export method and saved.
+    Records without any of the given trigger words in their raw payload are rejected before they get decoded.
+    With export_mode "shards" the sentences are appended to a few rotating JSONL shards instead of one file per website.
     No GPU functionality is used.
     """
 
-    def __init__(self, regex, out_dir):
+    def __init__(self, regex, out_dir, trigger_words=None, export_mode="files"):
         self.regex = regex
+        self.export_mode = export_mode
+        # created on first export, so that the pipeline stays picklable for the distributed stages
+        self.shard_writer = None
+        # lowercase byte strings of which every regex match contains at least one, None disables the keyword gate
+        self.trigger_words = [word.lower().encode("utf-8") for word in trigger_words] if trigger_words else None
         max_content_length = 1000000000
         super().__init__(out_dir=out_dir, max_content_length=max_content_length)
 
     def get_distributed_filter(self):
         """
-        Method taken from RegexCounterPipeline.
-        Replaced re.findall(text) with regex.findall(text) for use of precompiled regexes.
+        Method overwritten from TextPipeline.
+        Accepts every text, the texts are filtered by the generator instead (see get_sentence_filter), so that the
+        extracted sentences stay with their record.
+        """
+
+        def distributed_filter(text):
+            return True
+
+        return distributed_filter
+
+    def get_sentence_filter(self):
+        """
+        Method taken from RegexCounterPipeline's distributed filter.
+        Replaced re.findall(text) with extract_matching_sentences(text, regex) for use of precompiled regexes. The
+        returned filter gives the matched sentences of an accepted text and None for a rejected one, so that the text
+        doesn't have to be scanned again on export.
         """
         regex = self.regex
         acc_counter = self.acc_counter
 
-        def distributed_filter(text):
+        def sentence_filter(text):
             if len(text) < 1000:
-                return False
-            n_matches = len(regex.findall(text))
-            if n_matches == 0:
-                return False
+                acc_counter.add(collections.Counter({"n_rejected_length": 1}))
+                return None
+            sentences, n_matches = extract_matching_sentences(text, regex)
+            if not sentences:
+                acc_counter.add(collections.Counter({"n_rejected_regex": 1}))
+                return None
             if not resiliparse.parse.lang.detect_fast(text)[0] == "en":
+                acc_counter.add(collections.Counter({"n_rejected_language": 1}))
+                return None
+            acc_counter.add(collections.Counter({"n_regex_matches": n_matches, "n_accepted": 1}))
+            return sentences
+
+        return sentence_filter
+
+    def get_distributed_record_filter(self):
+        """
+        Method overwritten from TextPipeline.
+        Adds a literal keyword gate on the raw, lowercased payload of every record the text pipeline would process.
+        Records containing none of the trigger words can't match the regex and are rejected before any decoding, html
+        extraction or regex work. Only the first KEYWORD_GATE_BYTES of a payload are scanned, by a reader of a copy of
+        the frozen record, so that the text pipeline still reads the payload from the start.
+        """
+        trigger_words = self.trigger_words
+        acc_counter = self.acc_counter
+        record_filter = super().get_distributed_record_filter()
+
+        def distributed_record_filter(record):
+            if not record_filter(record):
+                acc_counter.add(collections.Counter({"n_rejected_record": 1}))
+                return False
+            if trigger_words is None:
+                return True
+            record.freeze()
+            # the copy of a frozen record reads the same buffered payload with its own position
+            if not contains_trigger_word(copy.copy(record).reader, trigger_words):
+                acc_counter.add(collections.Counter({"n_rejected_keywords": 1}))
                 return False
-            acc_counter.add(collections.Counter({"n_regex_matches": n_matches}))
             return True
 
-        return distributed_filter
+        return distributed_record_filter
 
-    def tokenizer(self, text):
+    def get_generator_factory(self):
         """
-        Tokenizes website texts into sentences and returns them when matched with a regex.
-        Cleans website texts before tokenization from urls to avoid interferences with regex to match sentences, caused
-        by punctuations in urls.
-        :param text: str
-            text of matched website
-        :return: str
-            all sentences that got a match in one website
+        Method overwritten from TextPipeline.
+        Filters the yielded records with the sentence filter and replaces the export text of every accepted record with
+        the sentences extracted from it.
         """
-        urls = r"\((?P<url>https?://\S+)\)"
-        sentences = ".*?[.!?]"
+        sentence_filter = self.get_sentence_filter()
+        generator_factory = super().get_generator_factory()
 
-        reg_matches = self.regex.findall(text)
-        text_no_urls = re.sub(urls, "", text)
-        sentences = re.findall(sentences, text_no_urls)
-        matches = "\n".join([s for s in sentences if any(r in s for r in reg_matches)])
-        return matches
+        def sentence_generator_factory(file_identifier):
+            for text, export_text, url in generator_factory(file_identifier):
+                sentences = sentence_filter(text)
+                if sentences is not None:
+                    yield text, "\n".join(sentences), url
+
+        return sentence_generator_factory
 
     def export(self, prediction, export_text, url):
         """
         Method overwritten from TextPipeline.
-        Added tokenizer call when writing text to output file.
+        The export text already contains the matched sentences only, see get_generator_factory.
         """
         prediction = np.reshape(prediction, ())
         print(url.decode("utf-8"), prediction)
+        if self.export_mode == "shards":
+            if self.shard_writer is None:
+                self.shard_writer = ShardWriter(self.out_dir)
+            self.shard_writer.write(url.decode("utf-8"), float(prediction), export_text.decode("utf-8").split("\n"))
+            return
         with open(f"{self.out_dir}/{base64.urlsafe_b64encode(url[:128]).decode('utf-8')}_{prediction:1.4f}.txt",
                   "w") as f:
-            f.write(self.tokenizer(export_text.decode("utf-8"))+"\n")  # call tokenizer when writing to file
+            f.write(export_text.decode("utf-8") + "\n")
 
     def start_threads(self):
         def save_stats():
@@ -81,12 +210,78 @@ class FutureRegexFinderPipeline(PassthroughModelPipeline, TextPipeline):
                 with open(f"{self.out_dir}/stats.json", 'w') as f:
                     json.dump(self.acc_counter.value, f)
 
+        def flush_shards():
+            while True:
+                time.sleep(1)
+                if self.shard_writer is not None:
+                    self.shard_writer.flush_if_due()
+
         threading.Thread(target=save_stats, daemon=True).start()
+        if self.export_mode == "shards":
+            threading.Thread(target=flush_shards, daemon=True).start()
 
         super().start_threads()
 
+    def close(self):
+        """
+        Writes the buffered sentences of the shard export mode.
+        """
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+
+
+def benchmark_tokenizer(regex, path, sentences_per_page=50, repeat=3):
+    """
+    Compares the throughput of the single-pass sentence matcher with the former findall-then-rescan approach.
+    Pages are built by joining consecutive lines of a candidates textfile (e.g. data/classification_set.txt).
+    :param regex: re.Pattern
+        precompiled regex to search for
+    :param path: str
+        path to textfile with one sentence per line
+    :param sentences_per_page: int
+        number of lines joined into one page
+    :param repeat: int
+        number of timed passes over all pages, the fastest one is reported
+    """
+
+    def findall_rescan(text):
+        reg_matches = regex.findall(text)
+        text_no_urls = URL_PATTERN.sub("", text)
+        sentences = SENTENCE_PATTERN.findall(text_no_urls)
+        return [s for s in sentences if any(r in s for r in reg_matches)]
+
+    def single_pass(text):
+        return extract_matching_sentences(text, regex)[0]
+
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    pages = [" ".join(lines[i:i + sentences_per_page]) for i in range(0, len(lines), sentences_per_page)]
+    print(f"{len(pages)} pages, {sum(len(page) for page in pages) / len(pages):.0f} characters per page on average")
+
+    results = {}
+    for name, tokenize in [("findall + rescan", findall_rescan), ("single pass", single_pass)]:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results[name] = [tokenize(page) for page in pages]
+            best = min(best, time.perf_counter() - start)
+        print(f"{name}: {len(pages) / best:.1f} pages/s")
+
+    n_equal = sum(a == b for a, b in zip(*results.values()))
+    print(f"identical output for {n_equal}/{len(pages)} pages")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract candidate sentences from WARC files with regexes.")
+    parser.add_argument("--benchmark", nargs="?", const="data/classification_set.txt", action="store",
+                        help="Benchmark the sentence matcher on pages built from a given textfile instead of running "
+                             "the pipeline.")
+    parser.add_argument("--export_mode", choices=["files", "shards"], default="files",
+                        help="Write one .txt file per website or append to a few rotating .jsonl shards per worker.")
+    parser.add_argument("--no_keyword_gate", action="store_true",
+                        help="Don't reject records without trigger words before decoding them.")
+    args = parser.parse_args()
+
     interesting_snippets = [
         "someday",
         "in the future",
@@ -98,8 +293,19 @@ if __name__ == "__main__":
         "in [the next]*\s?[like|about|around|maybe|ca]*\s?a?\s?[1-9][0-9]?[0-9]?[0-9]?[0-9]?[0-9]? (?:months?|years?|decades?)"
     ]
 
+    # every match of the snippets above contains at least one of these words
+    trigger_words = ["year", "time", "month", "future", "decade", "someday", "upcoming"]
+
     regex = "|".join(interesting_snippets)
     regex = re.compile(regex, re.IGNORECASE)
+    if args.benchmark:
+        benchmark_tokenizer(regex, args.benchmark)
+        sys.exit(0)
+
     out_dir = "data/future_regex_finder/out/"
-    p = FutureRegexFinderPipeline(regex, out_dir)
-    p.run()
+    p = FutureRegexFinderPipeline(regex, out_dir, trigger_words=None if args.no_keyword_gate else trigger_words,
+                                  export_mode=args.export_mode)
+    try:
+        p.run()
+    finally:
+        p.close()
@@ -0,0 +1,62 @@
+from functools import partial
+
+from small_text.integrations.transformers.classifiers.classification import TransformerBasedClassification, \
+    transformers_collate_fn
+from small_text.integrations.transformers.classifiers.factories import TransformerBasedClassificationFactory
+
+# classes of this module are pickled with the active learner, so they must not live in a script run as __main__
+
+
+def trimmed_collate_fn(batch, multi_label=None, num_classes=None, use_sample_weights=False):
+    """
+    Collates a batch like small-text and cuts the padding down to the longest sentence of the batch. The rows of the
+    encoded pool are all padded to the longest sentence of the pool, see active_learning.preprocess_data().
+    :param batch: List[Tuple]
+        rows of a TransformersDataset
+    :return: Tuple[torch.Tensor]
+        input ids, attention masks, labels and sample weights of the batch
+    """
+    text, masks, label, weights = transformers_collate_fn(batch, multi_label, num_classes, use_sample_weights)
+    length = max(int(masks.sum(dim=1).max()), 1)
+    return text[:, :length], masks[:, :length], label, weights
+
+
+class DynamicPaddingClassification(TransformerBasedClassification):
+    """
+    TransformerBasedClassification whose training and prediction batches are padded dynamically to their longest
+    sentence.
+    """
+
+    def _create_collate_fn(self, use_sample_weights=False):
+        return partial(trimmed_collate_fn, multi_label=self.multi_label, num_classes=self.num_classes,
+                       use_sample_weights=use_sample_weights)
+
+
+class DynamicPaddingClassificationFactory(TransformerBasedClassificationFactory):
+
+    def new(self):
+        return DynamicPaddingClassification(self.transformer_model_args, self.num_classes, **self.kwargs)
+
+
+def configure_retraining(active_learner, iteration, incremental=True, epochs=2, full_retrain_every=5):
+    """
+    Chooses how the next update() of the active learner trains: incrementally, i.e. continuing from the weights of the
+    previous round for a capped number of epochs, or from scratch like small-text does by default.
+    :param active_learner: PoolBasedActiveLearner
+        small-text's main active learning object
+    :param iteration: int
+        number of the round, starting with 1
+    :param incremental: Boolean
+        switch to train incrementally, False retrains from scratch in every round
+    :param epochs: int
+        number of epochs of an incremental round
+    :param full_retrain_every: int
+        retrain from scratch every full_retrain_every rounds, None never retrains from scratch
+    :return Boolean
+        True if the round retrains from scratch
+    """
+    full_retrain = not incremental or bool(full_retrain_every and iteration % full_retrain_every == 0)
+    active_learner.reuse_model = not full_retrain
+    if not full_retrain:
+        active_learner.classifier.num_epochs = epochs
+    return full_retrain
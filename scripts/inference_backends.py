@@ -0,0 +1,217 @@
+import hashlib
+import inspect
+import os
+import shutil
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+
+from inference_cache import model_id
+from inference_engine import tokenize, predict_proba
+
+BACKENDS = ["torch", "int8", "onnx", "onnx-int8"]
+ARTIFACT_DIR = "models/backends"
+
+
+class OnnxModel:
+    """
+    Runs an exported sequence classification model with ONNX Runtime behind the interface of a PreTrainedModel that
+    predict_proba() uses.
+    """
+
+    def __init__(self, path, config):
+        """
+        :param path: str
+            path to the .onnx graph
+        :param config: PretrainedConfig
+            config of the exported model
+        """
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        # follow the thread setting of torch, see Predictor
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.config = config
+        self.device = torch.device("cpu")
+
+    def eval(self):
+        return self
+
+    def __call__(self, input_ids, attention_mask):
+        logits = self.session.run(["logits"], {"input_ids": input_ids.numpy(),
+                                               "attention_mask": attention_mask.numpy()})[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+class _LogitsOnly(torch.nn.Module):
+    # ONNX export needs a plain tensor output instead of a ModelOutput
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids, attention_mask=attention_mask).logits
+
+
+def artifact_path(source, backend, artifact_dir=ARTIFACT_DIR):
+    """
+    :param source: str
+        path or name of the fp32 model, a new checkpoint at the same path gets a new artifact
+    :param backend: str
+        one of BACKENDS
+    :param artifact_dir: str
+        directory of all converted artifacts
+    :return: str
+        directory of the converted artifact
+    """
+    key = hashlib.blake2b(model_id(source).encode("utf-8"), digest_size=8).hexdigest()
+    name = os.path.basename(os.path.normpath(source)).replace(".", "_")
+    return os.path.join(artifact_dir, f"{name}-{key}-{backend}")
+
+
+def backend_model_id(source, backend):
+    """
+    :param source: str
+        path or name of the fp32 model
+    :param backend: str
+        one of BACKENDS
+    :return: str
+        id of the model in the inference cache, predictions of different backends are kept apart
+    """
+    return model_id(source) if backend == "torch" else f"{model_id(source)}#{backend}"
+
+
+def quantize(model):
+    """
+    :param model: PreTrainedModel
+        the fp32 model
+    :return: PreTrainedModel
+        the model with dynamically int8 quantized linear layers
+    """
+    return torch.ao.quantization.quantize_dynamic(model.cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def convert(model, tokenizer, backend, path):
+    """
+    Converts a fp32 model and saves it with its tokenizer and config.
+    :param model: PreTrainedModel
+        the fp32 sequence classification model
+    :param tokenizer: AutoTokenizer
+        containing the tokenizer of the model
+    :param backend: str
+        one of BACKENDS except "torch"
+    :param path: str
+        directory of the converted artifact
+    """
+    # every process converts into its own directory, worker processes may start converting at the same time
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    model = model.cpu().eval()
+    if backend == "int8":
+        torch.save(quantize(model).state_dict(), os.path.join(tmp_path, "model.pt"))
+    else:
+        example = tokenizer(["an example sentence", "another one"], padding=True, return_tensors="pt")
+        # the dynamo based exporter of newer torch versions needs the optional onnxscript package
+        kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+        onnx_path = os.path.join(tmp_path, "model.onnx")
+        torch.onnx.export(_LogitsOnly(model), (example["input_ids"], example["attention_mask"]), onnx_path,
+                          input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                          dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                        "attention_mask": {0: "batch", 1: "sequence"}, "logits": {0: "batch"}},
+                          opset_version=14, **kwargs)
+        if backend == "onnx-int8":
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            quantize_dynamic(onnx_path, os.path.join(tmp_path, "model_int8.onnx"), weight_type=QuantType.QInt8)
+            os.replace(os.path.join(tmp_path, "model_int8.onnx"), onnx_path)
+    model.config.save_pretrained(tmp_path)
+    tokenizer.save_pretrained(tmp_path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process finished first
+        shutil.rmtree(tmp_path)
+
+
+def load_backend(load_fn, source, backend="torch", artifact_dir=ARTIFACT_DIR):
+    """
+    Loads a model with the given backend. Converted artifacts are cached on disk, the fp32 model is only loaded to
+    create a missing artifact.
+    :param load_fn: Callable
+        returns the fp32 model and its tokenizer
+    :param source: str
+        path or name of the fp32 model, used to find its artifacts
+    :param backend: str
+        one of BACKENDS, "torch" returns the fp32 model
+    :param artifact_dir: str
+        directory of all converted artifacts
+    :return: PreTrainedModel or OnnxModel
+        the model
+    :return: AutoTokenizer
+        containing the tokenizer of the model
+    """
+    if backend == "torch":
+        return load_fn()
+    path = artifact_path(source, backend, artifact_dir)
+    if not os.path.isdir(path):
+        print(f"converting {source} to {path}...")
+        convert(*load_fn(), backend, path)
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    if backend == "int8":
+        # the quantized layers are rebuilt from the config, so that only their weights have to be stored
+        model = quantize(AutoModelForSequenceClassification.from_config(AutoConfig.from_pretrained(path)))
+        model.load_state_dict(torch.load(os.path.join(path, "model.pt"), weights_only=True))
+        return model.eval(), tokenizer
+    return OnnxModel(os.path.join(path, "model.onnx"), AutoConfig.from_pretrained(path)), tokenizer
+
+
+def parity_check(load_fn, source, backend, sentences, labels=None, batch_size=32, max_tokens=16384, max_length=500,
+                 artifact_dir=ARTIFACT_DIR):
+    """
+    Compares the predictions and the throughput of a backend with the fp32 model.
+    :param load_fn: Callable
+        returns the fp32 model and its tokenizer
+    :param source: str
+        path or name of the fp32 model
+    :param backend: str
+        one of BACKENDS
+    :param sentences: List[str]
+        sentences to predict
+    :param labels: np.ndarray
+        true class indices of the sentences, None skips the accuracy
+    :param batch_size: int
+        maximum number of sentences per forward pass
+    :param max_tokens: int
+        maximum number of (padded) tokens per forward pass
+    :param max_length: int
+        maximum sequence length to encode, None uses the maximum length of the tokenizer
+    :param artifact_dir: str
+        directory of all converted artifacts
+    :return: dict
+        agreement of the predicted classes, maximum probability difference and accuracy of both models, throughput
+        of both models in sentences per second
+    """
+    results = {}
+    for name in ["torch", backend]:
+        model, tokenizer = load_backend(load_fn, source, name, artifact_dir)
+        input_ids = tokenize(tokenizer, sentences, max_length=max_length or tokenizer.model_max_length)
+        predict_proba(model, tokenizer, input_ids[:batch_size], batch_size, max_tokens)  # warm up
+        start = time.perf_counter()
+        probabilities = predict_proba(model, tokenizer, input_ids, batch_size, max_tokens)
+        results[name] = (probabilities, len(sentences) / (time.perf_counter() - start))
+
+    (fp32, fp32_throughput), (converted, converted_throughput) = results["torch"], results[backend]
+    report = {"agreement": float(np.mean(fp32.argmax(axis=1) == converted.argmax(axis=1))),
+              "max_probability_difference": float(np.abs(fp32 - converted).max()),
+              "fp32_throughput": fp32_throughput, f"{backend}_throughput": converted_throughput}
+    if labels is not None:
+        report["fp32_accuracy"] = float(np.mean(fp32.argmax(axis=1) == labels))
+        report[f"{backend}_accuracy"] = float(np.mean(converted.argmax(axis=1) == labels))
+    for key, value in report.items():
+        print(f"{key}: {value:.4f}")
+    return report
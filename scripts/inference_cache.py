@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+
+class InferenceCache:
+    """
+    Persistent SQLite cache of class probabilities, keyed by model id and sentence hash.
+    Every model version gets its own model id, so that entries of older checkpoints are never returned and can be
+    evicted per model.
+    """
+
+    def __init__(self, path, model_id):
+        """
+        :param path: str
+            path to the SQLite database, gets created if it doesn't exist
+        :param model_id: str
+            id of the model whose predictions are read and written, see model_id()
+        """
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS predictions (model TEXT NOT NULL, sentence_hash BLOB NOT NULL, "
+                                "probabilities BLOB NOT NULL, PRIMARY KEY (model, sentence_hash)) WITHOUT ROWID")
+
+    def lookup(self, sentences, chunk_size=500):
+        """
+        Looks up the cached probabilities of the given sentences.
+        :param sentences: List[str]
+            sentences to look up
+        :param chunk_size: int
+            number of sentences per query
+        :return: List[np.ndarray]
+            probabilities of every sentence, None for cache misses
+        """
+        hashes = [sentence_hash(sentence) for sentence in sentences]
+        cached = {}
+        for start in range(0, len(hashes), chunk_size):
+            chunk = hashes[start:start + chunk_size]
+            rows = self.connection.execute(
+                "SELECT sentence_hash, probabilities FROM predictions WHERE model = ? AND sentence_hash IN ({})"
+                .format(",".join("?" * len(chunk))), [self.model_id, *chunk])
+            cached.update((bytes(key), np.frombuffer(value, dtype=np.float32)) for key, value in rows)
+        results = [cached.get(key) for key in hashes]
+        n_hits = sum(result is not None for result in results)
+        self.hits += n_hits
+        self.misses += len(results) - n_hits
+        return results
+
+    def store(self, sentences, probabilities):
+        """
+        Stores the probabilities of the given sentences.
+        :param sentences: List[str]
+            predicted sentences
+        :param probabilities: np.ndarray
+            probabilities of shape (number of sentences, number of classes)
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)",
+                ((self.model_id, sentence_hash(sentence), np.asarray(probability, dtype=np.float32).tobytes())
+                 for sentence, probability in zip(sentences, probabilities)))
+
+    def hit_rate(self):
+        """
+        :return: float
+            share of looked up sentences that were cached
+        """
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def close(self):
+        self.connection.close()
+
+
+def sentence_hash(sentence):
+    """
+    :param sentence: str
+        sentence to hash
+    :return: bytes
+        16 byte blake2b digest of the sentence
+    """
+    return hashlib.blake2b(sentence.encode("utf-8"), digest_size=16).digest()
+
+
+def model_id(model_path):
+    """
+    Builds the cache id of a model. Checkpoint files and directories are identified by their path, size and
+    modification time, so that a new checkpoint at the same path invalidates all its cached predictions.
+    Model names of the HuggingFace hub are used as they are.
+    :param model_path: str
+        path to a checkpoint or name of a model
+    :return: str
+        model id
+    """
+    if not os.path.exists(model_path):
+        return model_path
+    paths = [os.path.join(root, name) for root, _, names in os.walk(model_path) for name in names] \
+        if os.path.isdir(model_path) else [model_path]
+    stats = [os.stat(path) for path in paths]
+    version = hashlib.blake2b(digest_size=8)
+    for path, stat in sorted(zip(paths, stats)):
+        version.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return f"{os.path.normpath(model_path)}@{version.hexdigest()}"
+
+
+def cached_predict_proba(cache, sentences, predict_fn, num_labels, verbose=False):
+    """
+    Computes class probabilities, only cache misses are passed to the model.
+    :param cache: InferenceCache
+        cache of the model, None disables caching
+    :param sentences: List[str]
+        sentences to predict
+    :param predict_fn: Callable
+        computes the probabilities of a list of sentences
+    :param num_labels: int
+        number of classes
+    :param verbose: Boolean
+        switch to print the hit rate on the console
+    :return: np.ndarray
+        probabilities of shape (number of sentences, number of classes)
+    """
+    if cache is None:
+        return predict_fn(sentences)
+
+    probabilities = np.empty((len(sentences), num_labels), dtype=np.float32)
+    misses = []
+    for i, cached in enumerate(cache.lookup(sentences)):
+        if cached is None:
+            misses.append(i)
+        else:
+            probabilities[i] = cached
+    if verbose:
+        print(f"cache hits: {len(sentences) - len(misses)}/{len(sentences)}")
+    if misses:
+        miss_sentences = [sentences[i] for i in misses]
+        miss_probabilities = predict_fn(miss_sentences)
+        cache.store(miss_sentences, miss_probabilities)
+        probabilities[misses] = miss_probabilities
+    return probabilities
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and maintain the inference cache.")
+    parser.add_argument("cache", help="Path to the cache database.")
+    parser.add_argument("--list", action="store_true", help="List the cached model ids with their number of entries.")
+    parser.add_argument("--evict", nargs=1, action="store",
+                        help="Delete all entries of model ids starting with a given prefix, e.g. a checkpoint path.")
+    parser.add_argument("--keep_current", nargs=1, action="store",
+                        help="Delete all entries of older versions of a given checkpoint.")
+    parser.add_argument("--compact", action="store_true", help="Reclaim the space of deleted entries.")
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.cache)
+    with connection:
+        if args.evict:
+            deleted = connection.execute("DELETE FROM predictions WHERE substr(model, 1, ?) = ?",
+                                         (len(args.evict[0]), args.evict[0])).rowcount
+            print(f"{deleted} entries deleted")
+        if args.keep_current:
+            path = os.path.normpath(args.keep_current[0])
+            current = model_id(args.keep_current[0])
+            # entries of converted backends of the current version carry the same id with a suffix
+            deleted = connection.execute("DELETE FROM predictions WHERE substr(model, 1, ?) = ? "
+                                         "AND substr(model, 1, ?) != ?",
+                                         (len(path) + 1, path + "@", len(current), current)).rowcount
+            print(f"{deleted} entries deleted")
+    if args.compact:
+        connection.execute("VACUUM")
+    if args.list:
+        for model, count in connection.execute("SELECT model, COUNT(*) FROM predictions GROUP BY model"):
+            print(model, count)
+    connection.close()
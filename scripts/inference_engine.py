@@ -0,0 +1,215 @@
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def tokenize(tokenizer, data, max_length=500):
+    """
+    Tokenizes a list of string sentences in one batched call without padding, so that every batch can later be padded
+    only to its own longest member.
+    :param tokenizer: AutoTokenizer
+        containing the tokenizer of the model
+    :param data: List[str]
+        the text data
+    :param max_length: int
+        Maximum sequence length to encode
+    :return List[List[int]]
+        input ids of every sentence
+    """
+    return tokenizer(list(data), add_special_tokens=True, truncation='longest_first',
+                     max_length=max_length)['input_ids']
+
+
+def length_sorted_batches(lengths, batch_size, max_tokens):
+    """
+    Groups sentences of similar length into batches. A batch is closed when it holds batch_size sentences or when
+    padding all of its sentences to its longest member would exceed the token budget.
+    :param lengths: List[int]
+        number of tokens of every sentence
+    :param batch_size: int
+        maximum number of sentences per batch
+    :param max_tokens: int
+        maximum number of (padded) tokens per batch
+    :return: Iterator[np.ndarray]
+        indices of the sentences of every batch
+    """
+    order = np.argsort(lengths, kind='stable')
+    start = 0
+    for end in range(1, len(order) + 1):
+        # sentences are sorted by length, so the last one of a batch is its longest
+        if end == len(order) or end - start == batch_size or (end + 1 - start) * lengths[order[end]] > max_tokens:
+            yield order[start:end]
+            start = end
+
+
+def predict_proba(model, tokenizer, input_ids, batch_size=32, max_tokens=16384, verbose=False):
+    """
+    Computes the class probabilities of tokenized sentences without building autograd state. The sentences are
+    batched by length and every batch is padded only to its longest member. The probabilities are written in place
+    into one array in the original order of the sentences.
+    :param model: PreTrainedModel
+        the sequence classification model
+    :param tokenizer: AutoTokenizer
+        containing the tokenizer of the model, used for padding
+    :param input_ids: List[List[int]]
+        input ids of every sentence
+    :param batch_size: int
+        maximum number of sentences per forward pass
+    :param max_tokens: int
+        maximum number of (padded) tokens per forward pass
+    :param verbose: Boolean
+        switch to print the progress on the console
+    :return np.ndarray
+        probabilities of shape (number of sentences, number of classes)
+    """
+    model.eval()
+    device = model.device
+    probabilities = np.empty((len(input_ids), model.config.num_labels), dtype=np.float32)
+    lengths = [len(ids) for ids in input_ids]
+    with torch.inference_mode():
+        for i, batch_indices in enumerate(length_sorted_batches(lengths, batch_size, max_tokens)):
+            if verbose:
+                print('inference on batch', i + 1)
+            batch = tokenizer.pad({'input_ids': [input_ids[j] for j in batch_indices]}, padding='longest',
+                                  return_tensors='pt')
+            logits = model(batch['input_ids'].to(device), attention_mask=batch['attention_mask'].to(device)).logits
+            probabilities[batch_indices] = F.softmax(logits, dim=1).cpu().numpy()
+    return probabilities
+
+
+# model of a worker process, see Predictor
+_worker = {}
+
+
+def _init_worker(load_fn, threads, options):
+    torch.set_num_threads(threads)
+    _worker["model"], _worker["tokenizer"] = load_fn()
+    _worker["options"] = options
+
+
+def _predict_shard(sentences):
+    return _predict(_worker["model"], _worker["tokenizer"], sentences, **_worker["options"])
+
+
+def _num_labels():
+    return _worker["model"].config.num_labels
+
+
+def _predict(model, tokenizer, sentences, batch_size, max_tokens, max_length, verbose):
+    input_ids = tokenize(tokenizer, sentences, max_length=max_length or tokenizer.model_max_length)
+    return predict_proba(model, tokenizer, input_ids, batch_size, max_tokens, verbose)
+
+
+class Predictor:
+    """
+    Computes the class probabilities of sentences, either in this process or data-parallel in worker processes that
+    each load their own replica of the model. Workers get contiguous shards of the sentences and their results are
+    merged in the original order.
+    """
+
+    def __init__(self, load_fn, workers=1, threads=None, batch_size=32, max_tokens=16384, max_length=500,
+                 verbose=False):
+        """
+        :param load_fn: Callable
+            returns the model and its tokenizer, has to be picklable (a module level function or a partial of it)
+            if workers are used
+        :param workers: int
+            number of worker processes, 1 runs the model in this process
+        :param threads: int
+            number of torch threads per process, defaults to the number of cores divided by the number of workers
+            for worker processes and to the torch default otherwise
+        :param batch_size: int
+            maximum number of sentences per forward pass
+        :param max_tokens: int
+            maximum number of (padded) tokens per forward pass
+        :param max_length: int
+            maximum sequence length to encode, None uses the maximum length of the tokenizer
+        :param verbose: Boolean
+            switch to print the progress on the console
+        """
+        self.workers = workers
+        self.options = {"batch_size": batch_size, "max_tokens": max_tokens, "max_length": max_length,
+                        "verbose": verbose}
+        if workers == 1:
+            if threads:
+                torch.set_num_threads(threads)
+            self.model, self.tokenizer = load_fn()
+            self.num_labels = self.model.config.num_labels
+            self.pool = None
+        else:
+            threads = threads or max(1, (os.cpu_count() or 1) // workers)
+            # spawned workers don't inherit the thread pools of torch, which can deadlock after a fork
+            self.pool = multiprocessing.get_context("spawn").Pool(workers, initializer=_init_worker,
+                                                                  initargs=(load_fn, threads, self.options))
+            self.num_labels = self.pool.apply(_num_labels)
+
+    def predict(self, sentences):
+        """
+        :param sentences: List[str]
+            sentences to predict
+        :return: np.ndarray
+            probabilities of shape (number of sentences, number of classes)
+        """
+        if self.pool is None:
+            return _predict(self.model, self.tokenizer, sentences, **self.options)
+        # a few shards per worker balance sentences of different lengths
+        n_shards = min(self.workers * 4, max(len(sentences) // self.options["batch_size"], 1))
+        bounds = np.linspace(0, len(sentences), n_shards + 1, dtype=int)
+        shards = [sentences[start:end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        results = self.pool.map(_predict_shard, shards, chunksize=1)
+        return np.concatenate(results) if results else np.empty((0, self.num_labels), dtype=np.float32)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def benchmark_layouts(load_fn, sentences, workers_options=(1, 2, 4, 8), threads_options=(1, 2, 4, 8), batch_size=32,
+                      max_tokens=16384, max_length=500):
+    """
+    Measures the throughput of every layout of worker processes and threads per worker that fits onto the cores of
+    this machine. Loading the replicas is not timed.
+    :param load_fn: Callable
+        returns the model and its tokenizer, has to be picklable
+    :param sentences: List[str]
+        sentences to predict
+    :param workers_options: Iterable[int]
+        numbers of worker processes to try
+    :param threads_options: Iterable[int]
+        numbers of torch threads per worker to try
+    :param batch_size: int
+        maximum number of sentences per forward pass
+    :param max_tokens: int
+        maximum number of (padded) tokens per forward pass
+    :param max_length: int
+        maximum sequence length to encode, None uses the maximum length of the tokenizer
+    :return: List[Tuple[int, int, float]]
+        workers, threads per worker and sentences per second of every layout
+    """
+    cores = os.cpu_count() or 1
+    layouts = [(workers, threads) for workers in workers_options for threads in threads_options
+               if workers * threads <= cores or (workers, threads) == (1, 1)]
+    results = []
+    print(f"{len(sentences)} sentences, {cores} cores")
+    for workers, threads in layouts:
+        with Predictor(load_fn, workers, threads, batch_size, max_tokens, max_length) as predictor:
+            predictor.predict(sentences[:batch_size * workers])  # warm up every replica
+            start = time.perf_counter()
+            predictor.predict(sentences)
+            throughput = len(sentences) / (time.perf_counter() - start)
+        results.append((workers, threads, throughput))
+        print(f"workers: {workers}, threads per worker: {threads}, {throughput:.1f} sentences/s")
+    best = max(results, key=lambda result: result[2])
+    print(f"best layout: --workers {best[0]} --threads {best[1]}")
+    return results
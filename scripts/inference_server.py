@@ -0,0 +1,348 @@
+import argparse
+import collections
+import functools
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from emotion_inference import MODEL_NAME, TARGET_NAMES
+from emotion_inference import load_model as load_emotion_model
+from future_inference import FUTURE_STATEMENT, default_model_path
+from future_inference import load_model as load_future_model
+
+# number of latencies kept for the percentiles of /metrics
+LATENCY_WINDOW = 10000
+
+
+class MicroBatcher:
+    """
+    Coalesces the sentences of concurrent requests into micro-batches for one model. A batch is closed when it holds
+    max_batch_size sentences or when its oldest request has waited max_latency seconds, whatever comes first.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_latency=0.01):
+        """
+        :param predict_fn: Callable
+            computes the probabilities of a list of sentences
+        :param max_batch_size: int
+            maximum number of sentences per batch, larger requests form a batch of their own
+        :param max_latency: float
+            maximum time in seconds a request waits for other requests to join its batch
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.batch_sizes = collections.deque(maxlen=LATENCY_WINDOW)
+        self.n_requests = 0
+        self.n_sentences = 0
+        # guards the metrics, which are read by the request threads while the batching thread appends to them
+        self.metrics_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def predict(self, sentences):
+        """
+        Blocks until the batch with the given sentences is predicted.
+        :param sentences: List[str]
+            sentences to predict
+        :return: np.ndarray
+            probabilities of shape (number of sentences, number of classes)
+        """
+        request = {"sentences": sentences, "arrival": time.perf_counter(), "done": threading.Event()}
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify()
+        request["done"].wait()
+        if "error" in request:
+            raise request["error"]
+        return request["result"]
+
+    def next_batch(self):
+        """
+        :return: List[dict]
+            requests of the next batch
+        """
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = self.pending[0]["arrival"] + self.max_latency
+            while sum(len(request["sentences"]) for request in self.pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch, size = [], 0
+            while self.pending and (not batch or size + len(self.pending[0]["sentences"]) <= self.max_batch_size):
+                request = self.pending.popleft()
+                batch.append(request)
+                size += len(request["sentences"])
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            sentences = [sentence for request in batch for sentence in request["sentences"]]
+            try:
+                probabilities = self.predict_fn(sentences)
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+                    request["done"].set()
+                continue
+            finished = time.perf_counter()
+            start = 0
+            for request in batch:
+                request["result"] = probabilities[start:start + len(request["sentences"])]
+                start += len(request["sentences"])
+                request["done"].set()
+            with self.metrics_lock:
+                self.latencies.extend(finished - request["arrival"] for request in batch)
+                self.batch_sizes.append(len(sentences))
+                self.n_requests += len(batch)
+                self.n_sentences += len(sentences)
+
+    def metrics(self):
+        """
+        :return: dict
+            number of requests and sentences, latency percentiles in milliseconds and mean batch fill of the recent
+            requests and batches
+        """
+        with self.metrics_lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = np.array(self.batch_sizes)
+            n_requests, n_sentences = self.n_requests, self.n_sentences
+        return {"requests": n_requests, "sentences": n_sentences,
+                **{f"latency_p{p}_ms": float(np.percentile(latencies, p)) if len(latencies) else None
+                   for p in (50, 90, 99)},
+                "mean_batch_size": float(batch_sizes.mean()) if len(batch_sizes) else None,
+                "mean_batch_fill": float(batch_sizes.mean() / self.max_batch_size) if len(batch_sizes) else None}
+
+
+def classify(future_batcher, emotion_batcher, sentences):
+    """
+    Classifies statements about the future and the emotions of these statements.
+    :param future_batcher: MicroBatcher
+        batcher of the future statement model
+    :param emotion_batcher: MicroBatcher
+        batcher of the emotion model
+    :param sentences: List[str]
+        sentences to classify
+    :return: dict
+        future statement label of every sentence and the emotion probabilities of every statement about the future
+        (None for the other sentences)
+    """
+    labels = future_batcher.predict(sentences).argmax(axis=1)
+    positives = [i for i, label in enumerate(labels) if label == FUTURE_STATEMENT]
+    emotions = [None] * len(sentences)
+    if positives:
+        probabilities = emotion_batcher.predict([sentences[i] for i in positives])
+        for i, probability in zip(positives, probabilities):
+            emotions[i] = dict(zip(TARGET_NAMES, probability.tolist()))
+    return {"future_statement": labels.tolist(), "emotions": emotions}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with {"sentences": [...]} classifies sentences, GET /metrics returns the metrics of both batchers.
+    """
+    # keep connections of clients open between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_json(404, {"error": "unknown path"})
+            return
+        try:
+            sentences = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["sentences"]
+        except (KeyError, TypeError, ValueError):
+            sentences = None
+        # invalid sentences would fail the whole micro-batch, i.e. the requests of other clients too
+        if not isinstance(sentences, list) or not sentences or not all(isinstance(s, str) for s in sentences):
+            self.send_json(400, {"error": 'expected {"sentences": [...]} with a non-empty list of strings'})
+            return
+        try:
+            result = classify(self.server.future_batcher, self.server.emotion_batcher, sentences)
+        except Exception as e:
+            self.send_json(500, {"error": repr(e)})
+            return
+        self.send_json(200, result)
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_json(404, {"error": "unknown path"})
+            return
+        self.send_json(200, {"future": self.server.future_batcher.metrics(),
+                             "emotion": self.server.emotion_batcher.metrics()})
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per request would flood the job log
+
+
+class TCPHTTPServer(ThreadingHTTPServer):
+    # many clients connect at once under load, the default backlog of 5 resets their connections
+    request_queue_size = 128
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def connect(address):
+    """
+    :param address: str
+        HOST:PORT of the server or path of its Unix socket
+    :return: http.client.HTTPConnection
+        connection to the server
+    """
+    host, _, port = address.rpartition(":")
+    if port.isdigit():
+        return http.client.HTTPConnection(host, int(port))
+    return UnixHTTPConnection(address)
+
+
+def serve(address, max_batch_size=64, max_latency=0.01, backend="torch", max_tokens=16384):
+    """
+    Loads both models once and serves requests until the process gets killed.
+    :param address: str
+        HOST:PORT to listen on or path of a Unix socket
+    :param max_batch_size: int
+        maximum number of sentences per micro-batch
+    :param max_latency: float
+        maximum time in seconds a request waits for other requests to join its micro-batch
+    :param backend: str
+        inference backend, one of BACKENDS of inference_backends.py
+    :param max_tokens: int
+        maximum number of (padded) tokens per forward pass
+    """
+    from inference_backends import load_backend
+    from inference_engine import Predictor
+
+    future_path = default_model_path()
+    future_predictor = Predictor(functools.partial(load_backend, functools.partial(load_future_model, future_path),
+                                                   future_path, backend), batch_size=max_batch_size,
+                                 max_tokens=max_tokens)
+    emotion_predictor = Predictor(functools.partial(load_backend, functools.partial(load_emotion_model, MODEL_NAME),
+                                                    MODEL_NAME, backend), batch_size=max_batch_size,
+                                  max_tokens=max_tokens, max_length=None)
+
+    host, _, port = address.rpartition(":")
+    if port.isdigit():
+        server = TCPHTTPServer((host, int(port)), RequestHandler)
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server = UnixHTTPServer(address, RequestHandler)
+    server.future_batcher = MicroBatcher(future_predictor.predict, max_batch_size, max_latency)
+    server.emotion_batcher = MicroBatcher(emotion_predictor.predict, max_batch_size, max_latency)
+    print(f"serving on {address}")
+    server.serve_forever()
+
+
+def load_test(address, sentences, n_requests=1000, concurrency=16, sentences_per_request=1):
+    """
+    Sends requests from concurrent clients and reports the throughput, the latency percentiles seen by the clients and
+    the metrics of the server.
+    :param address: str
+        HOST:PORT of the server or path of its Unix socket
+    :param sentences: List[str]
+        sentences to send, cycled through
+    :param n_requests: int
+        total number of requests
+    :param concurrency: int
+        number of concurrent clients
+    :param sentences_per_request: int
+        number of sentences per request
+    :return: dict
+        throughput in sentences per second and latency percentiles in milliseconds
+    """
+    local = threading.local()
+
+    def send(i):
+        if not hasattr(local, "connection"):
+            local.connection = connect(address)
+        start = i * sentences_per_request
+        batch = [sentences[(start + j) % len(sentences)] for j in range(sentences_per_request)]
+        sent = time.perf_counter()
+        local.connection.request("POST", "/predict", json.dumps({"sentences": batch}),
+                                 {"Content-Type": "application/json"})
+        local.connection.getresponse().read()
+        return time.perf_counter() - sent
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = np.array(list(executor.map(send, range(n_requests)))) * 1000
+    duration = time.perf_counter() - start
+
+    report = {"sentences_per_second": n_requests * sentences_per_request / duration,
+              **{f"latency_p{p}_ms": float(np.percentile(latencies, p)) for p in (50, 90, 99)}}
+    for key, value in report.items():
+        print(f"{key}: {value:.1f}")
+    connection = connect(address)
+    connection.request("GET", "/metrics")
+    print("server metrics:", connection.getresponse().read().decode("utf-8"))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the future statement and emotion models or load test a server.")
+    parser.add_argument("--address", default="127.0.0.1:8080",
+                        help="HOST:PORT or path of a Unix socket to serve on or to connect to.")
+    parser.add_argument("--max_batch_size", type=int, default=64, help="Maximum number of sentences per micro-batch.")
+    parser.add_argument("--max_latency", type=float, default=10,
+                        help="Maximum time in milliseconds a request waits for other requests to join its micro-batch.")
+    parser.add_argument("--max_tokens", type=int, default=16384,
+                        help="Maximum number of (padded) tokens per forward pass.")
+    parser.add_argument("--backend", choices=["torch", "int8", "onnx", "onnx-int8"], default="torch",
+                        help="Inference backend of both models.")
+    parser.add_argument("--load_test", nargs="?", const="data/classification_set.pkl", action="store",
+                        help="Send sentences of a given dataset to a running server instead of serving.")
+    parser.add_argument("--requests", type=int, default=1000, help="Number of requests of the load test.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent clients of the load test.")
+    parser.add_argument("--sentences_per_request", type=int, default=1,
+                        help="Number of sentences per request of the load test.")
+    args = parser.parse_args()
+
+    if args.load_test:
+        from chunked_io import iter_batches
+
+        test_sentences = next(iter_batches(args.load_test, args.requests * args.sentences_per_request))
+        load_test(args.address, test_sentences["candidate"].values.tolist(), args.requests, args.concurrency,
+                  args.sentences_per_request)
+    else:
+        serve(args.address, args.max_batch_size, args.max_latency / 1000, args.backend, args.max_tokens)
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from chunked_io import write_data
+from inference_cache import sentence_hash
+
+JOURNAL_PATH = "data/labels.journal"
+
+
+class LabelJournal:
+    """
+    Append-only journal of manual labels shared by data_preprocessing.py and active_learning.py. Every label is one
+    JSON line with the sentence hash, the label, the labeling tool and a timestamp. Lines are flushed right away, but
+    only synced to disk every sync_every labels or sync_interval seconds, so that labeling costs O(1) per sentence
+    and a crash loses at most the unsynced labels. Later labels of a sentence replace earlier ones, see compact().
+    """
+
+    def __init__(self, path=JOURNAL_PATH, sync_every=20, sync_interval=5.0):
+        """
+        :param path: str
+            path to the journal, gets created if it doesn't exist
+        :param sync_every: int
+            maximum number of labels between two syncs
+        :param sync_interval: float
+            maximum number of seconds between two syncs
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.file = open(path, "a", encoding="utf8")
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def append(self, sentence, label, source):
+        """
+        :param sentence: str
+            the labeled sentence
+        :param label: int
+            its label
+        :param source: str
+            name of the labeling tool
+        """
+        entry = {"hash": sentence_hash(sentence).hex(), "label": int(label), "source": source,
+                 "time": dt.today().isoformat(), "candidate": sentence}
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_journal(path=JOURNAL_PATH, sources=None):
+    """
+    Reads the latest label of every sentence of a journal.
+    :param path: str
+        path to the journal
+    :param sources: List[str]
+        only read labels of the given labeling tools, None reads all labels
+    :return: DataFrame
+        with the columns "hash", "label", "source", "time" and "candidate", one row per sentence in the order of its
+        latest label
+    """
+    entries = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # the last line of a killed session may be incomplete
+                    continue
+    journal = pd.DataFrame(entries, columns=["hash", "label", "source", "time", "candidate"])
+    if sources is not None:
+        journal = journal[journal["source"].isin(sources)]
+    return journal.drop_duplicates("hash", keep="last").reset_index(drop=True)
+
+
+def labeled_hashes(path=JOURNAL_PATH, sources=None):
+    """
+    :param path: str
+        path to the journal
+    :param sources: List[str]
+        only consider labels of the given labeling tools, None considers all labels
+    :return: Set[bytes]
+        hashes of all labeled sentences, see inference_cache.sentence_hash()
+    """
+    return {bytes.fromhex(key) for key in read_journal(path, sources)["hash"]}
+
+
+def compact(path=JOURNAL_PATH, output_path="data/candidates_labeled.pkl", sources=None):
+    """
+    Writes the latest label of every sentence of a journal as a labeled dataset.
+    :param path: str
+        path to the journal
+    :param output_path: str
+        path ending with .pkl or a directory for .parquet part files
+    :param sources: List[str]
+        only write labels of the given labeling tools, None writes all labels
+    :return: DataFrame
+        with the columns "candidate" (str) and "label" (int16)
+    """
+    journal = read_journal(path, sources)
+    data = journal[["candidate", "label"]].astype({'candidate': str, 'label': np.dtype('int16')})
+    write_data(data, output_path)
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact the label journal into a labeled dataset.")
+    parser.add_argument("--journal", default=JOURNAL_PATH, help="Path to the label journal.")
+    parser.add_argument("--compact", nargs="?", const="data/candidates_labeled.pkl", action="store",
+                        help="Write the latest label of every sentence to a given path (.pkl or .parquet directory).")
+    parser.add_argument("--sources", nargs="+", help="Only use labels of the given tools, e.g. data_preprocessing.")
+    args = parser.parse_args()
+
+    if args.compact:
+        labeled = compact(args.journal, args.compact, args.sources)
+        print(f"{len(labeled)} labeled sentences written to {args.compact}")
+        print(labeled["label"].value_counts())
+    else:
+        print(read_journal(args.journal, args.sources).groupby(["source", "label"]).size())
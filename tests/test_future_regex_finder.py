@@ -0,0 +1,90 @@
+import collections
+import copy
+import io
+import os
+import re
+import sys
+import types
+
+import pytest
+
+fastwarc = pytest.importorskip("fastwarc.warc")
+pytest.importorskip("resiliparse.parse.lang")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+try:
+    import pipelines.text_pipeline  # noqa: F401
+except ImportError:
+    # WARC-DL (tensorflow) is not needed for the record filter, only its base classes are replaced
+    class _Counter:
+        def __init__(self):
+            self.value = collections.Counter()
+
+        def add(self, counter):
+            self.value.update(counter)
+
+    class TextPipeline:
+        def __init__(self, out_dir, max_content_length):
+            self.out_dir = out_dir
+            self.max_content_length = max_content_length
+            self.acc_counter = _Counter()
+
+        def get_distributed_record_filter(self):
+            return lambda record: True
+
+    class PassthroughModelPipeline:
+        pass
+
+    for name, attributes in [("pipelines", {}), ("pipelines.text_pipeline", {"TextPipeline": TextPipeline}),
+                             ("pipelines.tools", {}),
+                             ("pipelines.tools.passthrough_model",
+                              {"PassthroughModelPipeline": PassthroughModelPipeline})]:
+        sys.modules[name] = types.ModuleType(name)
+        sys.modules[name].__dict__.update(attributes)
+
+from future_regex_finder import FutureRegexFinderPipeline, contains_trigger_word  # noqa: E402
+
+REGEX = re.compile("in the future|in (?:a|the next) (?:months?|years?)", re.IGNORECASE)
+TRIGGER_WORDS = ["future", "year", "month"]
+FILLER = "The weather was nice and we walked along the river for a while. " * 20
+
+
+def make_record(text):
+    payload = (b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n<html><body><p>"
+               + text.encode("utf-8") + b"</p></body></html>")
+    record = fastwarc.WarcRecord()
+    record.init_headers(fastwarc.WarcRecordType.response)
+    record.headers["WARC-Target-URI"] = "https://example.org/"
+    record.set_bytes_content(payload)
+    buffer = io.BytesIO()
+    record.write(buffer)
+    buffer.seek(0)
+    return next(iter(fastwarc.ArchiveIterator(buffer, parse_http=False)))
+
+
+def test_gated_record_keeps_payload_and_yields_sentences(tmp_path):
+    pipeline = FutureRegexFinderPipeline(REGEX, str(tmp_path), trigger_words=TRIGGER_WORDS)
+    record = make_record(FILLER + "We will travel to Mars In The Future. " + FILLER)
+
+    assert pipeline.get_distributed_record_filter()(record)
+    # the text pipeline reads the payload after the filter
+    payload = record.reader.read()
+    assert payload.startswith(b"HTTP/1.1 200 OK")
+    text = payload.decode("utf-8")
+    assert pipeline.get_sentence_filter()(text) == [" We will travel to Mars In The Future."]
+
+
+def test_record_without_trigger_words_is_rejected(tmp_path):
+    pipeline = FutureRegexFinderPipeline(REGEX, str(tmp_path), trigger_words=TRIGGER_WORDS)
+    record = make_record(FILLER)
+
+    assert not pipeline.get_distributed_record_filter()(record)
+    assert pipeline.acc_counter.value["n_rejected_keywords"] == 1
+
+
+def test_trigger_word_across_chunks():
+    assert contains_trigger_word(io.BytesIO(b"a" * 7 + b"FUTURE"), [b"future"], chunk_size=10)
+    assert not contains_trigger_word(io.BytesIO(b"a" * 30), [b"future"], chunk_size=10)
+    # payloads longer than the scanned prefix are left to the regex
+    assert contains_trigger_word(io.BytesIO(b"a" * 30), [b"future"], max_bytes=20, chunk_size=10)